@@ -23,6 +23,20 @@ logger = logging.getLogger()
 logger.setLevel(loglevel)
 
 
+def channel_string(values):
+    """
+    Convert a sequence of 16 per-channel values (0-255) into a string of characters, for use in a message packet.
+
+    :param values: Either a list of integers, or a bytes/bytearray object with one byte per channel
+    :return: A string with one character per channel
+    """
+    if isinstance(values, (bytes, bytearray)):
+        if sys.version_info.major > 2:
+            return values.decode('latin-1')    # One C-level conversion, instead of a chr() call per channel
+        return str(values)
+    return ''.join([chr(x) for x in values])
+
+
 class Beamformer(object):
     """
     This class is used to control the operation one polarisation of a Kaelus beamformer.
@@ -290,10 +304,11 @@ class Beamformer(object):
                 data = '\x7e' + data[1:].replace('\x7d', '\x7d\x5d').replace('\x7e', '\x7d\x5e')
             else:
                 data = data.replace('\x7d', '\x7d\x5d').replace('\x7e', '\x7d\x5e')
+            if logger.isEnabledFor(logging.DEBUG):   # Only build the hex dump if it will be logged
+                logger.debug("(%s) wrote '%s'" % (self.name, ' '.join([hex(ord(c)) for c in data])))
             if sys.version_info.major > 2:
                 data = data.encode('latin-1')
-            self.pol.write(data)
-            logger.debug("(%s) wrote '%s'" % (self.name, ' '.join([hex(ord(c)) for c in data])))
+            self.pol.write(data)    # The whole packet goes out in a single write() call
             if self.outcapture:
                 self.outcapture.write(data)
                 self.outcapture.flush()
@@ -310,7 +325,8 @@ class Beamformer(object):
                     inchars = self.pol.read(totlength - len(data))
                     if sys.version_info.major > 2:
                         inchars = inchars.decode('latin-1')
-                    logger.debug("(%s) Got '%s'" % (self.name, ' '.join([hex(ord(c)) for c in inchars])))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("(%s) Got '%s'" % (self.name, ' '.join([hex(ord(c)) for c in inchars])))
                     if not inchars:
                         timeouts += 1
                         if timeouts >= 2:
@@ -356,7 +372,8 @@ class Beamformer(object):
             gotreply = False
             self.RxMessage = ''
             data = self.GetPacket()    # Read a complete packet (long or short) and return it as a string with all escape characters processed.
-            logger.debug("(%s) Processing new packet: '" % self.name + ' '.join([hex(ord(c)) for c in data]) + "'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("(%s) Processing new packet: '" % self.name + ' '.join([hex(ord(c)) for c in data]) + "'")
             if len(data) < 5:
                 logger.error("(%s) Less than 5 bytes received." % self.name)
                 return     # We didn't get a full packet.
@@ -1180,14 +1197,14 @@ class Beamformer(object):
             logger.debug("(%s) 'Retrieved delay board sensor data" % self.name)
         return True
         
-    def SetDelaySwitches(self):
+    def SetDelaySwitches(self, update=True):
         """
     
         This method sets the delay switches in calibrated mode, so the delay that is set is the desired delay, and the beamformer will compensate so the delay switches are set to the closest value.
         
         - **Parameters**:
         
-            -  **None**
+            -  **update=True:** If True, send the 'UpdateDelays' command to activate the new delays. If False, the new delays are just loaded into the buffer, and UpdateDelays() must be called later to activate them.
             
         - **Returns**:
 
@@ -1197,15 +1214,16 @@ class Beamformer(object):
         with self.lock:
             control = self.getControlByte(flags=(ACK + EOR), sn=self.SequenceNumber, an=self.AckNumber)
             self.Message = self.CompileSmallMessage(control=control, command=0, length=19)    # delayswitches command
-            self.MessageAddendum = chr(33) + chr(0) + chr(16) + ''.join([chr(x) for x in self.ChannelDelay])     # [33,0,16]+self.ChannelDelay
+            self.MessageAddendum = chr(33) + chr(0) + chr(16) + channel_string(self.ChannelDelay)     # [33,0,16]+self.ChannelDelay
             self.MessageAddendum += self.ComputeChecksum16(self.MessageAddendum)
             self.Message += self.MessageAddendum
             ok = self.DoCommand()
             if not ok:
                 return False
-            ok = self.UpdateDelays()
-            if not ok:
-                return False
+            if update:
+                ok = self.UpdateDelays()
+                if not ok:
+                    return False
             logger.debug("(%s) Sent new delay values to buffer" % self.name)
         return True
 
@@ -1250,7 +1268,7 @@ class Beamformer(object):
         with self.lock:
             control = self.getControlByte(flags=(ACK + EOR), sn=self.SequenceNumber, an=self.AckNumber)
             self.Message = self.CompileSmallMessage(control=control, command=0, length=19)
-            self.MessageAddendum = chr(35) + chr(0) + chr(16) + ''.join([chr(x) for x in self.ChannelEnable])    # [35,0,16]+self.ChannelEnable
+            self.MessageAddendum = chr(35) + chr(0) + chr(16) + channel_string(self.ChannelEnable)    # [35,0,16]+self.ChannelEnable
             self.MessageAddendum += self.ComputeChecksum16(self.MessageAddendum)
             self.Message += self.MessageAddendum
             ok = self.DoCommand()
@@ -1300,7 +1318,7 @@ class Beamformer(object):
         with self.lock:
             control = self.getControlByte(flags=(ACK + EOR), sn=self.SequenceNumber, an=self.AckNumber)
             self.Message = self.CompileSmallMessage(control=control, command=0, length=19)
-            self.MessageAddendum = chr(34) + chr(0) + chr(16) + ''.join([chr(x) for x in self.ChannelDelayDiag])    # [34,0,16]+self.ChannelDelayDiag
+            self.MessageAddendum = chr(34) + chr(0) + chr(16) + channel_string(self.ChannelDelayDiag)    # [34,0,16]+self.ChannelDelayDiag
             self.MessageAddendum += self.ComputeChecksum16(self.MessageAddendum)
             self.Message += self.MessageAddendum
             ok = self.DoCommand()
@@ -1350,7 +1368,7 @@ class Beamformer(object):
         with self.lock:
             control = self.getControlByte(flags=(ACK + EOR), sn=self.SequenceNumber, an=self.AckNumber)
             self.Message = self.CompileSmallMessage(control=control, command=0, length=19)
-            self.MessageAddendum = chr(25) + chr(0) + chr(16) + ''.join([chr(x) for x in self.ChannelAttenuators])     # [25,0,16]+self.ChannelAttenuators
+            self.MessageAddendum = chr(25) + chr(0) + chr(16) + channel_string(self.ChannelAttenuators)     # [25,0,16]+self.ChannelAttenuators
             self.MessageAddendum += self.ComputeChecksum16(self.MessageAddendum)
             self.Message += self.MessageAddendum
             ok = self.DoCommand()
@@ -1400,7 +1418,7 @@ class Beamformer(object):
         with self.lock:
             control = self.getControlByte(flags=(ACK + EOR), sn=self.SequenceNumber, an=self.AckNumber)
             self.Message = self.CompileSmallMessage(control=control, command=0, length=19)
-            self.MessageAddendum = chr(36) + chr(0) + chr(16) + ''.join([chr(x) for x in self.ChannelEnableDiag])   # [36,0,16]+self.ChannelEnableDiag
+            self.MessageAddendum = chr(36) + chr(0) + chr(16) + channel_string(self.ChannelEnableDiag)   # [36,0,16]+self.ChannelEnableDiag
             self.MessageAddendum += self.ComputeChecksum16(self.MessageAddendum)
             self.Message += self.MessageAddendum
             ok = self.DoCommand()
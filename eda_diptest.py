@@ -90,6 +90,7 @@ if __name__ == '__main__':
     bfproxies = {}
     for clientid, url in BURLS.items():
         bfproxies[clientid] = Pyro4.Proxy(url)
+        bfproxies[clientid]._pyroSerializer = 'msgpack'  # edacom.py only accepts msgpack
 
     xarray = numpy.zeros(shape=(16, 16, 32768))
     yarray = numpy.zeros(shape=(16, 16, 32768))
@@ -11,6 +11,7 @@
       -The IP address of the Raspberry Pi that controls the Kaelus beamformer, defined in the KURL global variable below.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import glob
 import optparse
@@ -225,7 +226,7 @@ def print_status():
             withstring = 'with only MWA beamformers: %s ' % onlybfs
         else:
             withstring = ''
-        if cpos != (0.0, 0.0, 0.0):
+        if tuple(cpos) != (0.0, 0.0, 0.0):  # msgpack returns tuples as lists
             withstring += 'with delay centre of %s' % str(cpos)
         print(clientid)
         print("  Tracking MWA: %s %s" % (istracking, withstring))
@@ -590,6 +591,39 @@ def zenith_sweep():
             time.sleep(starttime + 6.0 - time.time())
 
 
+def divide_gain(data=None, zdata=None, out=None):
+    """Divide one spectrum by a reference (zenith, or zero-delay) spectrum, channel by channel, writing the
+       ratio into the preallocated array 'out', which must be initialised to zero.
+
+       Channels where the reference spectrum is zero (dead subbands, RFI notches) are dropped - they are left
+       as zero in 'out', not interpolated - so that no inf/NaN values end up in the median across loops.
+
+       :param data: numpy array (shape=(32768,)) containing the spectrum to divide
+       :param zdata: numpy array (shape=(32768,)) containing the reference spectrum
+       :param out: numpy array (shape=(32768,)) to write the result into
+       :return: the 'out' array
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        numpy.divide(data, zdata, out=out, where=(zdata != 0))
+    return out
+
+
+def median_xy(gainarrayx=None, gainarrayy=None):
+    """Take the median across all the loops (axis 0) of the X and Y gain arrays, to get rid of RFI.
+
+       The two reductions are independent, and numpy releases the GIL while sorting, so they are run
+       in parallel in two threads.
+
+       :param gainarrayx: numpy array of X pol gain values, with the loop number as the first axis
+       :param gainarrayy: numpy array of Y pol gain values, with the loop number as the first axis
+       :return: A tuple of (gainx, gainy) numpy arrays
+    """
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fx = ex.submit(numpy.median, gainarrayx, axis=0)
+        fy = ex.submit(numpy.median, gainarrayy, axis=0)
+        return fx.result(), fy.result()
+
+
 def domwagaintest():
     """Sweep the MWA (1st stage) BF's through delays of 0,1,2,4,8,16 and collect power data to see the
        relation between MWA BF delay line used, and output power. Keep the Kaelus delays the same.
@@ -660,12 +694,11 @@ def domwagaintest():
                     return
                 if bit == 0:
                     zarray = data
-                gainarrayx[loop][bit] = data[0] / zarray[0]
-                gainarrayy[loop][bit] = data[1] / zarray[1]
+                divide_gain(data[0], zarray[0], out=gainarrayx[loop][bit])
+                divide_gain(data[1], zarray[1], out=gainarrayy[loop][bit])
 
     if BIGDAS:
-        gainx = numpy.median(gainarrayx, axis=0)
-        gainy = numpy.median(gainarrayy, axis=0)  # Median across all the loops, to get rid of RFI
+        gainx, gainy = median_xy(gainarrayx, gainarrayy)  # Median across all the loops, to get rid of RFI
 
         now = time.ctime()
         hdu = fits.PrimaryHDU()
@@ -746,12 +779,11 @@ def dokaelusgaintest():
                     return
                 if bit == 0:
                     zarray = data
-                gainarrayx[loop][bit] = data[0] / zarray[0]
-                gainarrayy[loop][bit] = data[1] / zarray[1]
+                divide_gain(data[0], zarray[0], out=gainarrayx[loop][bit])
+                divide_gain(data[1], zarray[1], out=gainarrayy[loop][bit])
 
     if BIGDAS:
-        gainx = numpy.median(gainarrayx, axis=0)
-        gainy = numpy.median(gainarrayy, axis=0)  # Median across all the loops, to get rid of RFI
+        gainx, gainy = median_xy(gainarrayx, gainarrayy)  # Median across all the loops, to get rid of RFI
 
         now = time.ctime()
         hdu = fits.PrimaryHDU()
@@ -823,13 +855,12 @@ def dopowertest(az=0.0, el=90.0, ra=None, dec=None):
             print("Stale data - aborting")
             return
 
-        gainarrayx[loop] = data[0] / zarray[0]
-        gainarrayy[loop] = data[1] / zarray[1]
+        divide_gain(data[0], zarray[0], out=gainarrayx[loop])
+        divide_gain(data[1], zarray[1], out=gainarrayy[loop])
 
     print("Pointing back at zenith.")
     point_azel(az=0, el=90)
-    gainx = numpy.median(gainarrayx, axis=0)
-    gainy = numpy.median(gainarrayy, axis=0)  # Median across all the loops, to get rid of RFI
+    gainx, gainy = median_xy(gainarrayx, gainarrayy)  # Median across all the loops, to get rid of RFI
 
     outx = []
     outy = []
@@ -857,6 +888,7 @@ def init():
     bfproxies = {}
     for clientid, url in BURLS.items():
         bfproxies[clientid] = Pyro4.Proxy(url)
+        bfproxies[clientid]._pyroSerializer = 'msgpack'  # edacom.py only accepts msgpack
 
 
 if __name__ == '__main__':
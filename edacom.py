@@ -5,9 +5,11 @@ Runs on one Raspberry Pi inside each of the beamformer control boxes, to send po
 beamformers connected to that box.
 
 On startup, it:
-    -Checks that the hostname (as reported by 'hostname -A') is either 'eda1com or 'eda2com', and exits if not.
+    -Checks that the hostname is either 'eda1com or 'eda2com', and exits if not.
     -Uses the integer (1 or 2) in the hostname to determine whether this box is connected to the first
       eight beamformers (0-8), or the second eight beamformers (9-F).
+    -Connects to the local pigpiod daemon, which is used to clock the pointing bit streams out of the GPIO
+      pins with DMA-timed waveforms.
     -Starts a Pyro4 daemon on port 19987 to listen for (and execute) remote procedure calls over the network.
 
 On exit (eg, with a control-C or a 'kill' command), it:
@@ -16,29 +18,41 @@ On exit (eg, with a control-C or a 'kill' command), it:
 """
 
 import atexit
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
 from logging import handlers
 import optparse
+import os
+import queue
 import signal
-import subprocess
+import socket
 import sys
 import threading
 import time
 import warnings
 
 # noinspection PyUnresolvedReferences
-import RPi.GPIO as GPIO
+import pigpio
 
 import astropy
 import astropy.time
 import astropy.units
 from astropy.time import Time
-from astropy.coordinates import SkyCoord, EarthLocation
+import astropy.utils.data
+from astropy.coordinates import SkyCoord, EarthLocation, AltAz
+from astropy.utils import iers
 from astropy.utils.exceptions import AstropyWarning, ErfaWarning
 
 warnings.simplefilter('ignore', AstropyWarning)
 warnings.simplefilter('ignore', ErfaWarning)
 
+# Never try to download IERS or leap-second tables while pointing - use the tables bundled with astropy instead.
+iers.conf.auto_download = False
+iers.conf.auto_max_age = None
+astropy.utils.data.conf.remote_timeout = 1.0
+
 
 if sys.version_info.major == 2:
     # noinspection PyUnresolvedReferences
@@ -56,7 +70,8 @@ LOGFILE = "/tmp/edacom.log"
 
 class MWALogFormatter(logging.Formatter):
     def format(self, record):
-        return "%s: time %10.6f - %s" % (record.levelname, time.time(), record.getMessage())
+        # Use the time the message was logged, not the time it was written out by the log listener thread
+        return "%s: time %10.6f - %s" % (record.levelname, record.created, record.getMessage())
 
 
 mwalf = MWALogFormatter()
@@ -77,17 +92,26 @@ ch.setFormatter(mwalf)
 # rh.setLevel(LOGLEVEL_REMOTE)
 # rh.setFormatter(mwalf)
 
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
-# logger.addHandler(rh)
+# Log calls just put the record on a queue, and a background thread writes them out to the handlers, so
+# a slow write to the SD card can't hold up a pointing.
+log_q = queue.SimpleQueue()
+logger.addHandler(handlers.QueueHandler(log_q))
+listener = handlers.QueueListener(log_q, fh, ch, respect_handler_level=True)  # add rh here for remote logging
+listener.start()
+atexit.register(listener.stop)
+
+import numpy
 
 import Pyro4
 
 # noinspection PyUnresolvedReferences
 sys.excepthook = Pyro4.util.excepthook
 Pyro4.config.DETAILED_TRACEBACK = True
-Pyro4.config.SERIALIZERS_ACCEPTED.add('pickle')
+# Accept msgpack as well as the default serializers - edacmd, edatest and eda_diptest set their proxies to use it, and
+# Pyro4 replies using whatever serializer the caller used. Pickle and serpent stay accepted until every caller,
+# including the pycontroller master, has moved to msgpack. Note that msgpack turns tuples into lists.
+Pyro4.config.SERIALIZERS_ACCEPTED.add('msgpack')
+Pyro4.config.SOCK_REUSE = True  # So we can restart immediately on the same port
 
 import pyslave
 import pointing
@@ -100,12 +124,28 @@ STRICT = False
 
 ONLYBFs = None
 # ONLYBFs = ['E']
+ONLYBFS_MASK = 0xFFFF  # Same as ONLYBFs, as a bitmask with bit N set if first stage beamformer N (0-F) is enabled
 
 CPOS = (0.0, 0.0, 0.0)  # Offset from geometric centre, in metres, to use as delay centre for pointing calculations
 
-# IO pin allocations as (txdata, txclock, rxdata) for each of the 8 RxDOC cards in this box, numbered 1-8
-IOPINS = {1:(29, 16, 40), 2:(26, 15, 38), 3:(24, 13, 37), 4:(23, 12, 36), 5:(22, 11, 35), 6:(21, 10, 33), 7:(19, 8, 32),
-          8:(18, 7, 31)}
+# IO pin allocations as (txdata, txclock, rxdata) for each of the 8 RxDOC cards in this box, numbered 1-8. These are
+# Broadcom GPIO numbers, as used by pigpio. The physical board connector pins are:
+#   {1:(29, 16, 40), 2:(26, 15, 38), 3:(24, 13, 37), 4:(23, 12, 36), 5:(22, 11, 35), 6:(21, 10, 33), 7:(19, 8, 32),
+#    8:(18, 7, 31)}
+IOPINS = {1:(5, 23, 21), 2:(7, 22, 20), 3:(8, 27, 26), 4:(11, 18, 16), 5:(25, 17, 19), 6:(9, 15, 13), 7:(10, 14, 12),
+          8:(24, 4, 6)}
+
+PI = None  # pigpio.pi() connection to the local pigpiod daemon, created in init()
+
+NUMBITS = 252  # Length of the bit stream returned by gen_bitstring()
+
+WAVES = {}  # pigpio wave IDs, keyed by the bit streams sent and the bit time, so repeated pointings don't rebuild the wave
+WAVE_CBS = 2 * 3 * NUMBITS  # Approximate DMA control blocks used by one wave - three pulses per bit, two blocks per pulse
+MAXWAVES = 1  # Clear all cached waves when we reach this many, to stay inside the pigpio wave memory - set in init()
+WAVELOCK = threading.Lock()  # pigpio can only build and transmit one wave at a time
+
+RT_PRIORITY = 50  # SCHED_FIFO priority used while clocking in the readback bits
+RT_CPU = 3  # CPU core to pin the readback to - ideally isolated (isolcpus=3) with IRQs steered to the other cores
 
 # Timeout for PyController comms to the PointingSlave instance
 PS_TIMEOUT = 60
@@ -114,86 +154,143 @@ SIGNAL_HANDLERS = {}
 CLEANUP_FUNCTION = None
 
 MWAPOS = EarthLocation.from_geodetic(lon="116:40:14.93", lat="-26:42:11.95", height=377.8)
+MWA_ALTAZ = AltAz(location=MWAPOS)  # Built once, and copied with the right obstime for each conversion
+
+AZEL_CACHE_TIME = 30  # Az/El calculations are cached in bins of this many seconds - the sky moves 0.125 degrees in 30 seconds
+
+DELAY_CACHE = collections.OrderedDict()  # Results of pointing.calc_delays(), keyed by quantised az/el and delay settings
+DELAY_CACHE_SIZE = 1024  # Maximum number of entries in DELAY_CACHE, oldest are discarded first
+POINTING_TOLERANCE = 0.05  # Re-use the last delays if az and el have both changed by less than this, in degrees
+DELAY_LOCK = threading.Lock()  # DELAY_CACHE is shared between the Pyro worker threads and the precompute thread
 
 
 def init():
-    """Initialise IO pins for pointing comms with all 8 beamformers
+    """Connect to the pigpiod daemon, and initialise IO pins for pointing comms with all 8 beamformers
     """
-    GPIO.setmode(GPIO.BOARD)  # Use board connector pin numbers to specify I/O pins
-    GPIO.setwarnings(False)
+    global PI, MAXWAVES
+    PI = pigpio.pi()
+    if not PI.connected:
+        logger.critical("Can't connect to the pigpiod daemon - make sure it's running.")
+        sys.exit(-3)
+    PI.wave_clear()
+    # Only use half of the control blocks available for all waves, to leave a safety margin
+    MAXWAVES = max(1, PI.wave_get_max_cbs() // WAVE_CBS // 2)
+    logger.info("Caching up to %d pigpio waves", MAXWAVES)
     for i in range(1, 9):
         txdata, txclock, rxdata = IOPINS[i]
-        GPIO.setup(rxdata, GPIO.IN)
-        GPIO.setup(txdata, GPIO.OUT)
-        GPIO.setup(txclock, GPIO.OUT)
-
-#
-# def get_hostname():
-#     """Returns the hostname, with domain stripped off. Used to work out whether this Raspberry Pi controls MWA
-#        beamformers 0-8 (eda1com.mwa128t.org) or beamformers 9-F (eda2com.mwa128t.org).
-#     """
-#     if sys.version_info.major == 2:
-#         fqdn = subprocess.check_output(['hostname', '-A'], shell=False)
-#     else:
-#         fqdn = subprocess.check_output(['hostname', '-A'], shell=False).decode('UTF-8')
-#     return fqdn.split('.')[0]
+        PI.set_mode(rxdata, pigpio.INPUT)
+        PI.set_mode(txdata, pigpio.OUTPUT)
+        PI.set_mode(txclock, pigpio.OUTPUT)
+    try:
+        _ = Time.now().ut1  # Load the bundled IERS tables now, rather than on the first pointing
+    except Exception:
+        logger.warning("Can't preload IERS tables, continuing anyway")
 
 
 def get_hostname():
-    if sys.version_info.major == 2:
-        output = subprocess.check_output(['hostname'], shell=False)
-    else:
-        output = subprocess.check_output(['hostname'], shell=False).decode('UTF-8')
-    return output.strip().split('.')[0]
+    """Returns the hostname, with domain stripped off. Used to work out whether this Raspberry Pi controls MWA
+       beamformers 0-8 (eda1com.mwa128t.org) or beamformers 9-F (eda2com.mwa128t.org).
+    """
+    return socket.gethostname().split('.')[0]
 
 
-def point(starttime=0, bfnum=0, outstring='', results=None, resultlock=None):
+def point(starttime=0, outstrings=None):
     """
-       Called with the start time of the next observation (a unix timestamp), the beamformer number to point, and
-       the string containing the delay bits to write.
+       Called with the start time of the next observation (a unix timestamp), and a dictionary with beamformer
+       number (1-8) as key, and the string containing the delay bits to write to that beamformer as value.
 
-       Waits until the specified time, then sends the bit string to the beamformer. The results are written to the
-       given dictionary, using the lock supplied - this is because 'point' is called in parallel for all eight
-       beamformers, using the same results dictionary, so that all eight beamformers are pointed at the same instant.
+       Waits until the specified time, then sends the bit strings to all the beamformers at once, in a single
+       pigpio wave, so that all eight beamformers are pointed at the same instant.
 
        :param starttime: start time in seconds past the unix epoch,
-       :param bfnum: beamformer output number (1-8),
-       :param outstring: bit-string to send,
-       :param results: dictionary to store (temp, flag) returned from the beamformer,
-       :param resultlock: lock object to avoid conflicts writing to the results dict
-       :return:
+       :param outstrings: dictionary with beamformer output number (1-8) as key, and bit-string to send as value.
+       :return: list indexed by beamformer output number (1-8), with (temp, flag) returned from the beamformer as value.
     """
     now = time.time()
     if now < starttime:
-        logger.debug("bf %d is sleeping for %5.2f seconds" % (bfnum, starttime - now))
+        logger.debug("Sleeping for %5.2f seconds", starttime - now)
         time.sleep(starttime - now)
-    temp, flags = send_bitstring(bfnum=bfnum, outstring=outstring)
-    with resultlock:
-        results[bfnum] = (temp, flags)
-    logger.info("bf %d bitstring sent." % bfnum)
+    results = send_bitstring_all(outstrings=outstrings)
+    logger.info("bf %s bitstrings sent." % sorted(outstrings.keys()))
+    return results
+
+
+@functools.lru_cache(maxsize=4096)
+def _calc_azel_cached(ra=0.0, dec=0.0, calctime=0.0):
+    """Does the actual astropy calculation for calc_azel(), cached on the (already quantised) arguments.
+    """
+    # noinspection PyUnresolvedReferences
+    coords = SkyCoord(ra=ra, dec=dec, equinox='J2000', unit=(astropy.units.deg, astropy.units.deg))
+    cpos = coords.transform_to(MWA_ALTAZ.replicate(obstime=Time(calctime, format='unix', scale='utc')))
+    return float(cpos.az.deg), float(cpos.alt.deg)
 
 
 def calc_azel(ra=0.0, dec=0.0, calctime=None):
     """
        Takes RA and DEC in degrees, and calculates Az/El of target at the specified time
 
+       Results are cached, with RA and Dec rounded to 4 decimal places, and the time rounded to the middle
+       of an AZEL_CACHE_TIME second bin, so that repeated pointings don't repeat the astropy transform.
+
        :param ra: Right Ascension (J2000) in degrees
        :param dec: Declination (J2000) in degrees
        :param calctime: Time (as a unix time stamp) for the conversion, or None to calculate for the current time.
        :return: A tuple of (azimuth, elevation) in degrees
     """
-    # noinspection PyUnresolvedReferences
-    coords = SkyCoord(ra=ra, dec=dec, equinox='J2000', unit=(astropy.units.deg, astropy.units.deg))
     if calctime is None:
-        azeltime = Time.now()
-    else:
-        azeltime = Time(calctime, format='unix', scale='utc')
-    coords.location = MWAPOS
-    coords.obstime = azeltime
-    cpos = coords.transform_to('altaz')
+        calctime = time.time()
+    qtime = (int(calctime) // AZEL_CACHE_TIME) * AZEL_CACHE_TIME + AZEL_CACHE_TIME / 2.0
+    return _calc_azel_cached(ra=round(ra, 4), dec=round(dec, 4), calctime=qtime)
+
+
+def calc_azel_batch(ras=None, decs=None, times=None):
+    """
+       Vector form of calc_azel() - takes arrays of RA and Dec in degrees, and an array of times, and
+       calculates the Az/El of each target at the corresponding time, using a single astropy transform.
+
+       :param ras: Sequence of Right Ascensions (J2000) in degrees
+       :param decs: Sequence of Declinations (J2000) in degrees
+       :param times: Sequence of times (as unix time stamps) for each conversion
+       :return: A tuple of (azimuths, elevations), each a numpy array in degrees
+    """
+    # noinspection PyUnresolvedReferences
+    coords = SkyCoord(ra=numpy.asarray(ras, dtype=float), dec=numpy.asarray(decs, dtype=float), equinox='J2000',
+                      unit=(astropy.units.deg, astropy.units.deg))
+    cpos = coords.transform_to(MWA_ALTAZ.replicate(obstime=Time(numpy.asarray(times, dtype=float),
+                                                                format='unix', scale='utc')))
     return cpos.az.deg, cpos.alt.deg
 
 
+def calc_delays(offsets=None, az=0.0, el=90.0, clipdelays=True):
+    """
+       Wrapper around pointing.calc_delays(), using the current STRICT and CPOS globals, that caches
+       the results in DELAY_CACHE, keyed on az and el rounded to 3 decimal places.
+
+       A copy of the cached idelays structure is returned, so the caller can safely modify it.
+
+       :param offsets: dipole positions, as returned by pointing.getOffsets(asarray=True)
+       :param az: Azimuth in degrees
+       :param el: Elevation in degrees
+       :param clipdelays: passed to pointing.calc_delays()
+       :return: A tuple of (idelays, diagnostics), as returned by pointing.calc_delays()
+    """
+    key = (id(offsets), round(az, 3), round(el, 3), CPOS, STRICT, clipdelays)
+    with DELAY_LOCK:
+        cached = DELAY_CACHE.get(key)
+    if cached is not None:
+        idelays, diagnostics = cached
+    else:
+        idelays, diagnostics = pointing.calc_delays(offsets=offsets, az=az, el=el, strict=STRICT,
+                                                    verbose=True, clipdelays=clipdelays, cpos=CPOS)
+        with DELAY_LOCK:
+            DELAY_CACHE[key] = (idelays, diagnostics)
+            if len(DELAY_CACHE) > DELAY_CACHE_SIZE:
+                DELAY_CACHE.popitem(last=False)
+    if idelays is not None:
+        idelays = dict((bfid, dict(bfdelays)) for bfid, bfdelays in idelays.items())
+    return idelays, diagnostics
+
+
 class PointingSlave(pyslave.Slave):
     """Subclass the pycontroller slave class so we can override the notify() method to point the EDA.
 
@@ -211,8 +308,17 @@ class PointingSlave(pyslave.Slave):
         self.tileid = tileid
         self.orig_tileid = tileid  # Save the 'real' tile ID here, so we can change the 'current' one
         self.edanum = edanum
-        self.offsets = pointing.getOffsets()
+        self.offsets = pointing.getOffsets(asarray=True)
+        # Translate input 1-8 on edanum=1 or edanum=2 to a hex bfid in the idelays dict ('0' to 'F'), and to the row
+        # for that first stage beamformer in the delay array built by notify().
+        offset = 8 if edanum == 2 else 0
+        self._bfids = tuple(hex(bfnum - 1 + offset)[-1].upper() for bfnum in range(1, 9))
+        self._hexd_idx = dict((bfid, i) for i, bfid in enumerate(pointing.HEXD))
         self.lastpointing = (None, None, None, None, None, None, None, None, None)
+        self._last_delays = None  # Tuple of (CPOS, clipdelays, az, el, idelays, diagnostics) for the last calculation
+        # Background thread used to calculate the Az/El and delays for the next observation while we wait for
+        # (or clock out) the current one. The results end up in the calc_azel() and calc_delays() caches.
+        self._precompute_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='precomp')
         pyslave.Slave.__init__(self, clientid=clientid, rclass='pointing', port=port)
 
     @Pyro4.expose
@@ -246,10 +352,11 @@ class PointingSlave(pyslave.Slave):
            :param bfids: A list of hex digits (eg ['0', '4', 'A']), or a string of hex digits (eg '04A')
            :return: False if there was an error parsing the bfids argument, True if successful.
         """
-        global ONLYBFs
+        global ONLYBFs, ONLYBFS_MASK
         if bfids is None:
             logger.info('Enabling all channels')
             ONLYBFs = None
+            ONLYBFS_MASK = 0xFFFF
         elif (type(bfids) == list) or (isinstance(bfids, STR_CLASS)):
             onlybfs = []
             for bfid in bfids:
@@ -264,12 +371,13 @@ class PointingSlave(pyslave.Slave):
                     return False
             logger.info("Enabling only beamformers %s" % onlybfs)
             ONLYBFs = onlybfs
+            ONLYBFS_MASK = sum(1 << int(bfid, 16) for bfid in set(onlybfs))
 
     @Pyro4.expose
     def set_cpos(self, cpos=None):
         """Sets the position of the EDA centre used for delay calculations, relative to the geometric centre.
 
-           If cpos is not None, it must be a tuple of three floats, used as an offset from the geometrical
+           If cpos is not None, it must be a tuple (or list) of three floats, used as an offset from the geometrical
            EDA centre (0,0,0) in the units used in the locations file), in metres.
 
            The state is saved in a global variable, and lasts until the next call to set_cpos().
@@ -280,21 +388,16 @@ class PointingSlave(pyslave.Slave):
         global CPOS
         if cpos is None:
             CPOS = (0.0, 0.0, 0.0)
-        else:
-            if (type(cpos) == tuple) and (len(cpos) == 3):
-                ok = True
-                for element in cpos:
-                    if (type(element) != float) and (type(element) != int):
-                        ok = False
-                if ok:
-                    CPOS = cpos
-                    return True
-                else:
-                    logger.error('Invalid item in argument for set_cpos(%s) call' % cpos)
-                    return False
-            else:
-                logger.error('Invalid argument to set_cpos(%s)' % cpos)
+            return True
+        if not (isinstance(cpos, (tuple, list)) and (len(cpos) == 3)):  # msgpack sends tuples as lists
+            logger.error('Invalid argument to set_cpos(%s)' % (cpos,))
+            return False
+        for element in cpos:
+            if (not isinstance(element, (int, float))) or isinstance(element, bool):  # Don't accept strings or True/False
+                logger.error('Invalid item in argument for set_cpos(%s) call' % (cpos,))
                 return False
+        CPOS = tuple(float(element) for element in cpos)
+        return True
 
     @Pyro4.expose
     def is_tracking(self):
@@ -323,15 +426,50 @@ class PointingSlave(pyslave.Slave):
         """
         return (self.is_tracking(), ONLYBFs, CPOS, self.tileid, self.lastpointing)
 
+    def _precompute(self, starttime=None, stoptime=None, values=None):
+        """Calculate the Az/El (if given RA/Dec) and the delays for an upcoming observation, so that the
+           results are already in the calc_azel() and calc_delays() caches when notify() is called for it.
+
+           Runs in the precompute thread, so errors are logged rather than raised.
+
+           Takes the same starttime, stoptime and values arguments as notify().
+        """
+        try:
+            if self.tileid in values.keys():
+                xra, xdec, xaz, xel, xdelays = values[self.tileid]['X']
+            elif 0 in values.keys():
+                xra, xdec, xaz, xel, xdelays = values[0]['X']
+            else:
+                return
+            if xdelays and (type(xdelays) == dict):
+                return  # Raw delays, nothing to calculate
+            if (xra is not None) and (xdec is not None):
+                xaz, xel = calc_azel(ra=xra, dec=xdec, calctime=(((starttime + stoptime) / 2) if stoptime else starttime))
+            calc_delays(offsets=self.offsets, az=xaz, el=xel, clipdelays=(ONLYBFs is None))
+        except Exception:
+            logger.exception('Error precomputing delays for starttime=%s' % starttime)
+
+    @Pyro4.expose
+    def queue_next(self, obsid=None, starttime=None, stoptime=None, values=None):
+        """Called remotely to give advance warning of the next observation, so the Az/El and delay calculations
+           can be done in the background, before notify() is called for it.
+
+           Takes the same obsid, starttime, stoptime and values arguments as notify().
+
+           :return: True
+        """
+        logger.debug('Precomputing delays for obsid=%s, starttime=%s', obsid, starttime)
+        self._precompute_pool.submit(self._precompute, starttime=starttime, stoptime=stoptime, values=values)
+        return True
+
     @Pyro4.expose
     def notify(self, obsid=None, starttime=None, stoptime=None, clientid=None, rclass=None, values=None):
         """Called remotely by the master object when registered tile properties change.
 
            This takes the az/el pointing direction, converts to a list of 256 tuples for
-           the 256 AAVS antennae (x,y), and calls the point() function in parallel in eight
-           seperate threads. Each thread waits until the specified observation start time,
-           sends the new delays to its MWA beamformer, and returns True or False. If all eight
-           tiles point OK, the OK flag returned by this function is True.
+           the 256 AAVS antennae (x,y), and calls the point() function, which waits until the
+           specified observation start time, then sends the new delays to all eight MWA beamformers
+           at once. If all eight tiles point OK, the OK flag returned by this function is True.
 
            Note that while RA/Dec/Az/El/Delays are passed individually for both X and Y polarisation, the
            current code ignores the Y pol data, and uses the X pol data to set both the X and Y delay values.
@@ -373,7 +511,7 @@ class PointingSlave(pyslave.Slave):
         else:
             if (xra is not None) and (xdec is not None):
                 logger.info("Received RA/Dec=%s/%s for target at obsid=%s, time=%s, calculating Az/El" % (xra, xdec, obsid, starttime))
-                az, el = calc_azel(ra=xra, dec=xdec, calctime=(starttime + ((starttime - stoptime) / 2)))
+                az, el = calc_azel(ra=xra, dec=xdec, calctime=(((starttime + stoptime) / 2) if stoptime else starttime))
                 xaz = az
                 xel = el
             else:
@@ -383,8 +521,13 @@ class PointingSlave(pyslave.Slave):
                 clipdelays = False
             else:
                 clipdelays = True
-            idelays, diagnostics = pointing.calc_delays(offsets=self.offsets, az=xaz, el=xel, strict=STRICT,
-                                                        verbose=True, clipdelays=clipdelays, cpos=CPOS)
+            last = self._last_delays
+            if ((last is not None) and (last[0] == CPOS) and (last[1] == clipdelays) and
+                    (abs(xaz - last[2]) < POINTING_TOLERANCE) and (abs(xel - last[3]) < POINTING_TOLERANCE)):
+                idelays, diagnostics = last[4], last[5]  # Hasn't moved far enough to change the delays
+            else:
+                idelays, diagnostics = calc_delays(offsets=self.offsets, az=xaz, el=xel, clipdelays=clipdelays)
+                self._last_delays = (CPOS, clipdelays, xaz, xel, idelays, diagnostics)
             if diagnostics is not None:
                 delays, delayerrs, sqe, maxerr, offcount = diagnostics
                 if offcount > 0:
@@ -393,53 +536,33 @@ class PointingSlave(pyslave.Slave):
                 logger.error("Error calculating delays for az=%s, el=%s" % (xaz, xel))
                 return self.clientid, obsid, starttime, {self.tileid:(999, False)}
 
+        # Array of integer delays, with one row for each first stage beamformer, and one column for each dipole
+        hexd = pointing.HEXD
+        idelays_arr = numpy.array([[bf_delays[dipid] for dipid in hexd] for bf_delays in [idelays[bfid] for bfid in hexd]],
+                                  dtype=numpy.int16)
         if ONLYBFs is None:
-            offcount = 0
-            for bfid in pointing.HEXD:
-                for dipid in pointing.HEXD:
-                    if idelays[bfid][dipid] == 16:  # disabled
-                        offcount += 1
+            offcount = int((idelays_arr == 16).sum())  # A delay of 16 means the dipole is disabled
         else:
-            offcount = 0
+            disabled = (idelays_arr < -16) | (idelays_arr > 15)
+            enabled_bfs = ((ONLYBFS_MASK >> numpy.arange(16)) & 1).astype(bool)  # HEXD is '0' to 'F', in order
+            disabled |= ~enabled_bfs[:, None]
+            idelays_arr[disabled] = 16  # Disabled
+            offcount = int(disabled.sum())
             logger.warning(
                 "Only some first stage beamformer enabled (%s), other %d dipoles are disabled!" % (ONLYBFs, offcount))
-            for bfid in pointing.HEXD:
-                for dipid in pointing.HEXD:
-                    if bfid in ONLYBFs:
-                        if (idelays[bfid][dipid] < -16) or (idelays[bfid][dipid] > 15):
-                            idelays[bfid][dipid] = 16  # Disabled
-                            offcount += 1
-                    else:
-                        idelays[bfid][dipid] = 16  # Disabled
-                        offcount += 1
-
-        offset = 0
-        if self.edanum == 2:
-            offset = 8
-        comthreads = []  # Used to store the thread objects that are actually communicating with the beamformers
-        results = {}
-        resultlock = threading.RLock()
+
+        outstrings = {}
         for bfnum in range(1, 9):
-            bfid = hex(bfnum - 1 + offset)[-1].upper()  # Translate input 1-8 on edanum=1 or edanum=2 to a hex bfid in the idelays dict ('0' to 'F')
-            tiledelays = [idelays[bfid][hexd] + 16 for hexd in pointing.HEXD]  # raw idelays values range from -16 to +15, so need to add 16 before we send them to the beamformer
+            bfid = self._bfids[bfnum - 1]
+            tiledelays = (idelays_arr[self._hexd_idx[bfid]] + 16).tolist()  # raw idelays values range from -16 to +15, so need to add 16 before we send them to the beamformer
             logger.info("bfnum=%d, delays=%s" % (bfnum, tiledelays))
-            outstring = gen_bitstring(tiledelays, tiledelays)
-            newthread = threading.Thread(target=point,
-                                         name='com%s' % bfnum,
-                                         kwargs={'starttime':starttime,
-                                                 'bfnum':bfnum,
-                                                 'outstring':outstring,
-                                                 'results':results,
-                                                 'resultlock':resultlock})
-            newthread.start()
-            comthreads.append(newthread)
-        for t in comthreads:
-            t.join()
+            outstrings[bfnum] = gen_bitstring(tiledelays, tiledelays)
+        results = point(starttime=starttime, outstrings=outstrings)
         numok = 0
         sumtemp = 0.0
         for bfnum in range(1, 9):
             temp, flags = results[bfnum]
-            logger.debug('Port %d: Flags=%d, Temp=%4.1f' % (bfnum, flags, temp))
+            logger.debug('Port %d: Flags=%d, Temp=%4.1f', bfnum, flags, temp)
             if flags == 128:
                 numok += 1
                 sumtemp += temp
@@ -449,17 +572,23 @@ class PointingSlave(pyslave.Slave):
             logger.error("Errors in tiles: %s" % [(bfnum, results[bfnum]) for bfnum in range(1, 9) if results[bfnum][1] != 128])
         self.lastpointing = (starttime, obsid, xra, xdec, xaz, xel, xdelays, offcount, (numok == 8))
 
+        if (xra is not None) and (xdec is not None) and (stoptime is not None) and (stoptime > starttime):
+            # If we're tracking an RA/Dec, the next observation is probably the same target, starting when this one
+            # stops, so get the delays for that ready in the background.
+            self._precompute_pool.submit(self._precompute, starttime=stoptime,
+                                         stoptime=stoptime + (stoptime - starttime), values=values)
+
         if numok:
             avgtemp = sumtemp / numok
         else:
             avgtemp = 0.0
-        return self.clientid, obsid + self.edanum, starttime, {self.tileid:(avgtemp, (numok == 8))}
+        return self.clientid, obsid + self.edanum, starttime, {self.tileid:(float(avgtemp), bool(numok == 8))}
 
 
 def gen_bitstring(xdelays, ydelays):
     """Given two arrays of 16 integers, representing the xdelays and ydelays, return
-       a string containing 253 characters, each '1' or '0', representing the bit stream
-       to be sent to the beamformer.
+       an integer containing the NUMBITS bits of the bit stream to be sent to the beamformer,
+       with the first bit to be sent as the most significant bit.
 
        Format is:
           8 zeroes
@@ -470,70 +599,182 @@ def gen_bitstring(xdelays, ydelays):
           6 blocks of 17 bits, each containing a 16-bit number containing the packed 6-bit
               y delay values, followed by a '1' bit
           16 bits of checksum (the twelve 16-bit packed delay words XORed together)
-          A '1' bit to mark the end of the 13th 16-bit word
 
-          These 253 bits are returned as a string with 253 '1' and '0' characters.
+          Note that the '1' bit to mark the end of the 13th 16-bit word (the checksum) is not
+          sent, so the bit stream is 252 bits long.
 
           After those bits are clocked out, a further 24 clock pulses should be sent, and
           24 bits of data (16 bits containing a 12-bit signed temperature, and 8 bits of
           flags) will be received.
+
+       Returns None if any of the delay values won't fit in 6 bits.
     """
-    outlist = ['0' * 8, '1' * 4, '0' * 20]
-    dwords = []
+    dbits = 0  # All twelve 6-bit delay values, packed into 192 bits
     for val in (xdelays + ydelays):
         if (val < 0) or (val > 63):
             return  # Each delay value must fit in 6 bits
-        else:
-            dwords.append('{0:06b}'.format(val))
-    dstring = ''.join(dwords)
+        dbits = (dbits << 6) | val
+    bits = 0xF << 20  # 8 zeroes, 4 ones, 20 zeroes
     checksum = 0
-    for i in range(0, 12 * 16, 16):
-        checksum = checksum ^ int(dstring[i:i + 16], 2)
-        outlist.append(dstring[i:i + 16] + '1')
-    outlist.append('{0:016b}'.format(checksum))
-    return ''.join(outlist)  # 253 bits of output data
+    for i in range(11, -1, -1):
+        word = (dbits >> (i * 16)) & 0xFFFF
+        checksum ^= word
+        bits = (bits << 17) | (word << 1) | 1
+    return (bits << 16) | checksum  # NUMBITS bits of output data
+
+
+def _spin_ns(ns):
+    """Busy-wait for the given number of nanoseconds. Used instead of time.sleep() for the readback clock
+       pulses, because nanosleep() on the Raspberry Pi can't reliably sleep for less than ~100 microseconds.
+    """
+    end = time.perf_counter_ns() + ns
+    while time.perf_counter_ns() < end:
+        pass
+
+
+def set_realtime():
+    """Switch this thread to the SCHED_FIFO real-time scheduling policy, pinned to the RT_CPU core, so the
+       readback clock pulses aren't interrupted by other processes.
+
+       Returns the (policy, priority, affinity) to pass to restore_scheduling() afterwards, or None if we don't
+       have permission to change the scheduling policy.
+    """
+    try:
+        oldstate = (os.sched_getscheduler(0), os.sched_getparam(0).sched_priority, os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {RT_CPU})
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+    except (OSError, AttributeError):
+        logger.debug("Can't set real-time scheduling for readback, continuing without it")
+        return None
+    return oldstate
+
+
+def restore_scheduling(oldstate=None):
+    """Restore the scheduling policy and CPU affinity returned by set_realtime().
+    """
+    if oldstate is None:
+        return
+    policy, priority, affinity = oldstate
+    try:
+        os.sched_setscheduler(0, policy, os.sched_param(priority))
+        os.sched_setaffinity(0, affinity)
+    except OSError:
+        logger.error("Can't restore scheduling policy after readback")
+
+
+def get_wave(outstrings, bittime=0.00002):
+    """Return the ID of a pigpio wave that clocks out the given bit streams, all in parallel, using the
+       TXDATA and TXCLOCK pins for each beamformer, creating it if it isn't already cached.
+
+       outstrings is a dictionary with beamformer number (1-8) as key, and the bit stream (an integer of
+       NUMBITS bits, as returned by gen_bitstring(), sent most significant bit first) as value.
+
+       Must be called with WAVELOCK held.
+
+       For each bit, the data pins are set and left to settle for a quarter of the bit time, then the clocks
+       are sent high for half the bit time, then low for the final quarter, so data is valid on both the
+       rising and falling edge.
+    """
+    key = (tuple(sorted(outstrings.items())), bittime)
+    wid = WAVES.get(key)
+    if wid is None:
+        if len(WAVES) >= MAXWAVES:
+            PI.wave_clear()
+            WAVES.clear()
+        quarter = int(round(bittime * 1e6 / 4))  # Quarter of a bit time, in microseconds
+        clockmask = 0
+        streams = []  # List of (txdata pin mask, bit stream) tuples, so the per-bit loop doesn't need any lookups
+        for bfnum, outstring in outstrings.items():
+            clockmask |= 1 << IOPINS[bfnum][1]
+            streams.append((1 << IOPINS[bfnum][0], outstring))
+        pulses = []
+        for i in range(NUMBITS - 1, -1, -1):
+            onmask, offmask = 0, 0
+            for txmask, outstring in streams:
+                if (outstring >> i) & 1:
+                    onmask |= txmask
+                else:
+                    offmask |= txmask
+            pulses.append(pigpio.pulse(onmask, offmask, quarter))  # wait for data bits to settle
+            pulses.append(pigpio.pulse(clockmask, 0, 2 * quarter))  # Clocks high for half the bit time
+            pulses.append(pigpio.pulse(0, clockmask, quarter))  # Clocks low until the end of the bit time
+        PI.wave_add_generic(pulses)
+        wid = PI.wave_create()
+        WAVES[key] = wid
+    return wid
+
+
+def send_bitstring_all(outstrings, bittime=0.00002):
+    """Given a dictionary with beamformer number (1-8) as key, and a bit stream (as returned by gen_bitstring())
+       as value, clock them all out in lockstep using the TXDATA and TXCLOCK pins for each beamformer, then
+       clock in 24 bits of temp and flag data from all the RXDATA pins at once.
+
+       The outgoing bits are sent as a single pigpio wave, so the bit timing comes from the DMA engine, not
+       from the Python interpreter and kernel scheduler, and is identical for all the beamformers.
+
+       bittime is the total time to take to send one but, in seconds.
+
+       Returns a list indexed by beamformer number, with a tuple of (temp, flags) as value. Slot 0, and the slots
+       for any beamformers not in outstrings, are None.
+    """
+    with WAVELOCK:
+        wid = get_wave(outstrings, bittime)
+        PI.wave_send_once(wid)
+        while PI.wave_tx_busy():
+            time.sleep(0.001)
+
+        # While the temperature is 16 bits and the checksum is 8 bits, giving 24
+        # bits in total, we appear to have to clock an extra bit-time to complete the
+        # read-back operation. Once that's done, the checksum is the final (right-
+        # most) 8 bits, and the temperature is 13 bits (signed plus 12-bits). Both
+        # values are most-significant-bit first (chronologically).
+
+        datamask, clockmask = 0, 0
+        for bfnum in outstrings.keys():
+            datamask |= 1 << IOPINS[bfnum][0]
+            clockmask |= 1 << IOPINS[bfnum][1]
+        PI.clear_bank_1(datamask)
+        samples = []  # Levels of all the GPIO pins, sampled once per bit, decoded after the clocking is finished
+        quarter_ns = int(bittime * 250e6)  # Quarter of a bit time, in nanoseconds
+        oldstate = set_realtime()
+        try:
+            for i in range(25):  # Read in temp data
+                _spin_ns(quarter_ns)
+                PI.set_bank_1(clockmask)
+                _spin_ns(quarter_ns)
+                samples.append(PI.read_bank_1())  # Sample all the RXDATA pins at the same instant
+                _spin_ns(quarter_ns)
+                PI.clear_bank_1(clockmask)
+                _spin_ns(quarter_ns)
+        finally:
+            restore_scheduling(oldstate)
+
+    results = [None] * 9  # Indexed by beamformer number, 1-8
+    for bfnum in outstrings.keys():
+        rxpin = IOPINS[bfnum][2]
+        raw = 0  # All 25 bits read back from this beamformer
+        for levels in samples:
+            raw = (raw << 1) | ((levels >> rxpin) & 1)
+        rawtemp = raw >> 8  # Convert the first 16 bits to a temperature
+        temp = 0.0625 * (rawtemp & 0xfff)  # 12 bits of value
+        if (rawtemp & 0x1000):
+            temp -= 256.0
+        flags = raw & 0xFF
+        results[bfnum] = (temp, flags)
+    return results
 
 
 def send_bitstring(bfnum, outstring, bittime=0.00002):
-    """Given a string of 253 '1' or '0' characters, clock them out using the TXDATA and TXCLOCK
+    """Given a bit stream (as returned by gen_bitstring()), clock it out using the TXDATA and TXCLOCK
        pins, then clock in 24 bits of temp and flag data from the RXDATA pin.
 
        bittime is the total time to take to send one but, in seconds.
        bfnum is the beamformer number, from 1-8, used to find the correct IO pin numbers
              in the IOPINS dict.
+
+       Returns a tuple of (temp, flags).
     """
-    txdata, txclock, rxdata = IOPINS[bfnum]
-    for bit in outstring:
-        GPIO.output(txdata, {'1':1, '0':0}[bit])
-        time.sleep(bittime / 4)  # wait for data bit to settle
-        GPIO.output(txclock, 1)  # Send clock high
-        time.sleep(bittime / 2)  # Leave clock high for half the total bit transmit time
-        GPIO.output(txclock, 0)  # Send clock low,so data is valid on both rising and falling edge
-        time.sleep(bittime / 4)  # Leave data valid until the end of the bit transmit time
-
-    # While the temperature is 16 bits and the checksum is 8 bits, giving 24
-    # bits in total, we appear to have to clock an extra bit-time to complete the
-    # read-back operation. Once that's done, the checksum is the final (right-
-    # most) 8 bits, and the temperature is 13 bits (signed plus 12-bits). Both
-    # values are most-significant-bit first (chronologically).
-
-    GPIO.output(txdata, 0)
-    inbits = []
-    for i in range(25):  # Read in temp data
-        time.sleep(bittime / 4)
-        GPIO.output(txclock, 1)
-        time.sleep(bittime / 4)
-        inbits.append({True:'1', False:'0'}[GPIO.input(rxdata)])
-        time.sleep(bittime / 4)
-        GPIO.output(txclock, 0)
-        time.sleep(bittime / 4)
-
-    rawtemp = int(''.join(inbits[:17]), 2)  # Convert the first 16 bits to a temperature
-    temp = 0.0625 * (rawtemp & 0xfff)  # 12 bits of value
-    if (rawtemp & 0x1000):
-        temp -= 256.0
-    flags = int(''.join(inbits[17:]), 2)
-    return temp, flags
+    return send_bitstring_all(outstrings={bfnum:outstring}, bittime=bittime)[bfnum]
 
 
 def cleanup():
@@ -541,12 +782,13 @@ def cleanup():
        leaving hanging network ports.
     """
     global pcs
-    logger.info("Cleaning up GPIO library")
-    GPIO.cleanup()
+    logger.info("Cleaning up pigpio waves and connection")
+    if PI is not None:
+        PI.wave_clear()
+        PI.stop()
     logger.info("Shutting down network Pyro4 daemon")
     try:
-        pcs.exiting = True
-        pcs.pyro_daemon.shutdown()
+        pcs.stop()
     except NameError:
         pass  # In test mode, there's no PySlave instance
 
@@ -596,6 +838,7 @@ if __name__ == '__main__':
 
     init()
     calc_azel(ra=0.0, dec=-26.0)  # Run the astropy function once on startup, to preload all the ephemeris data and save time later
+    calc_azel_batch(ras=[0.0, 180.0], decs=[-26.0, -26.0], times=[time.time()] * 2)  # And the vector form
     RegisterCleanup(cleanup)
 
     if options.nohostcheck:
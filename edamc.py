@@ -5,7 +5,7 @@ Runs on one Raspberry Pi inside each of the beamformer control boxes, to do powe
 monitoring for the eight beamformers connected to that box.
 
 On startup, it:
-    -Checks that the hostname (as reported by 'hostname -A') is either 'eda1mc' or 'eda2mc', and exits if not.
+    -Checks that the hostname is either 'eda1mc' or 'eda2mc', and exits if not.
     -Turns on the 48V DC supply.
     -Turns on, and enables, each of the eight beamformer DoC cards in that box.
     -Loops forever, writing voltage and current information to stdout, and to /tmp/edamc.log.
@@ -20,15 +20,20 @@ sockets aren't 'live' with 48V DC.
 """
 
 import atexit
+import functools
 import logging
+from logging import handlers
 import optparse
 import signal
-import subprocess
+import socket
 import sys
+import threading
 import time
 
-import RPi.GPIO as GPIO
-import smbus
+import numpy
+# noinspection PyUnresolvedReferences
+import pigpio
+from smbus2 import SMBus, i2c_msg
 
 # set up the logging
 
@@ -36,11 +41,12 @@ LOGLEVEL_CONSOLE = logging.DEBUG  # Logging level for console messages (INFO, DE
 LOGLEVEL_LOGFILE = logging.DEBUG  # Logging level for logfile
 LOGLEVEL_REMOTE = logging.INFO
 LOGFILE = "/tmp/edamc.log"
+LOGFLUSH_INTERVAL = 30  # Write buffered log file records out at least this often, in seconds
 
 
 class MWALogFormatter(logging.Formatter):
     def format(self, record):
-        return "%s: time %10.6f - %s" % (record.levelname, time.time(), record.getMessage())
+        return "%s: time %10.6f - %s" % (record.levelname, record.created, record.getMessage())
 
 
 mwalf = MWALogFormatter()
@@ -60,29 +66,84 @@ ch.setFormatter(mwalf)
 # rh.setLevel(LOGLEVEL_REMOTE)
 # rh.setFormatter(mwalf)
 
+# Buffer log file writes, to save wear on the SD card. The buffer is written out when it has 64 records in it, when
+# a warning or error is logged, every LOGFLUSH_INTERVAL seconds, and on exit.
+mh = handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=fh)
+mh.setLevel(LOGLEVEL_LOGFILE)
+
+
+def flush_logs():
+    """
+    Runs forever in a background thread, flushing the log file buffer every LOGFLUSH_INTERVAL seconds.
+    """
+    while True:
+        time.sleep(LOGFLUSH_INTERVAL)
+        mh.flush()
+
+
+threading.Thread(target=flush_logs, name='logflush', daemon=True).start()
+
 # add the handlers to the logger
-logger.addHandler(fh)
+logger.addHandler(mh)
 logger.addHandler(ch)
 # logger.addHandler(rh)
 
 STATUS = None
-
-# IO pin allocations as (enable, power) for each of the 8 RxDOC cards in this box, numbered 1-8
-BFIOPINS = {1:(29, 16), 2:(26, 15), 3:(24, 13), 4:(23, 12), 5:(22, 11), 6:(21, 10), 7:(19, 8), 8:(18, 7)}
-
-POWER48 = 32
-ALARMPOWER = 36
-ALARM48 = 38
-DIGOUT1 = 33
-DIGOUT2 = 35
-DIGIN1 = 40
+_BUS = None  # SMBus connection to the I2C bus, opened the first time it's needed by _get_bus()
+PI = None  # pigpio.pi() connection to the local pigpiod daemon, created in init()
+
+# IO pin allocations as (enable, power) for each of the 8 RxDOC cards in this box, numbered 1-8. These are
+# Broadcom GPIO numbers, as used by pigpio. The physical board connector pins are:
+#   {1:(29, 16), 2:(26, 15), 3:(24, 13), 4:(23, 12), 5:(22, 11), 6:(21, 10), 7:(19, 8), 8:(18, 7)}
+BFIOPINS = {1:(5, 23), 2:(7, 22), 3:(8, 27), 4:(11, 18), 5:(25, 17), 6:(9, 15), 7:(10, 14), 8:(24, 4)}
+_BF_TABLE = [None] + [BFIOPINS[i] for i in range(1, 9)]  # The same, as a list indexed by bfnum
+
+POWER48 = 12  # Board pin 32
+ALARMPOWER = 16  # Board pin 36
+ALARM48 = 20  # Board pin 38
+DIGOUT1 = 13  # Board pin 33
+DIGOUT2 = 19  # Board pin 35
+DIGIN1 = 21  # Board pin 40
+
+STATUS_INTERVAL = 10  # Seconds between status checks, if no alarm inputs change state
+SLOW_CHECK = 1.0  # Log a warning if a status check takes longer than this many seconds (eg, I2C bus problems)
+ALARM_EVENT = threading.Event()  # Set by the GPIO edge callback when any of the alarm/digital input pins change
 
 BDICT = {False:'OFF', True:'ON'}
 
+# Format strings for the status report logged every STATUS_INTERVAL seconds
+_STATUS_FMT = "EDA Status: 48V=%3s (Alarm=%3s)\n  Beamformers:\n"
+_BF_FMT = "BF# %d: power=%3s, enable=%3s, voltage=%5.2f V, current=%4.0f mA"
+_BF_LINE_FMT = "    " + _BF_FMT + "\n"
+
 SIGNAL_HANDLERS = {}
 CLEANUP_FUNCTION = None
 
 
+def decode_ltc4151(data):
+    """Convert the raw contents of registers 0-3 from one or more LTC4151's to current and voltage.
+
+       Each value is 12 bits, with the top 8 bits in the first register and the bottom four bits in the
+       high nibble of the second register (the low nibble is reserved).
+
+       :param data: A sequence of four bytes, or an array of shape (N, 4) for N chips.
+       :return: A tuple of (current, voltage) arrays, each with N elements, in Amps and Volts.
+    """
+    raw = numpy.asarray(data, dtype=numpy.uint16).reshape(-1, 4)
+    current = ((raw[:, 0] << 4) | (raw[:, 1] >> 4)) * (20e-6 / 0.02)  # 20uV per ADU, through a 0.02 Ohm shunt
+    voltage = ((raw[:, 2] << 4) | (raw[:, 3] >> 4)) * 0.025  # 25mV per ADU
+    return current, voltage
+
+
+def _get_bus():
+    """Returns the SMBus connection to I2C bus 1, opening it if this is the first call.
+    """
+    global _BUS
+    if _BUS is None:
+        _BUS = SMBus(1)
+    return _BUS
+
+
 class DOCstatus(object):
     # Device addresses for the eight LTC4151's. Note that these are _seven_ bit addresses,
     # corresponding to D0,D2,D4,...DE when the r/w bit is appended as bit 0 of the address.
@@ -94,210 +155,303 @@ class DOCstatus(object):
         assert bus is not None
         self.bus = bus
         self.bfnum = bfnum
+        self.enable_pin, self.power_pin = BFIOPINS[bfnum]
+        self.address = self.ADDRESSES[bfnum]
         self.current = 0.0
         self.voltage = 0.0
-        self.enable = bool(GPIO.input(BFIOPINS[bfnum][0]))
-        self.power = bool(GPIO.input(BFIOPINS[bfnum][1]))
-
-    def check(self):
-        self.enable = bool(GPIO.input(BFIOPINS[self.bfnum][0]))
-        self.power = bool(GPIO.input(BFIOPINS[self.bfnum][1]))
-        try:
-            data = self.bus.read_i2c_block_data(self.ADDRESSES[self.bfnum], 0, 4)
-            self.current = ((data[0] * 16) + (data[1] / 16)) * 20e-6 / 0.02  # 20uV per ADU, through a 0.02 Ohm shunt
-            self.voltage = ((data[2] * 16) + (data[3] / 16)) * 0.025  # 25mV per ADU
-        except IOError:
-            self.current = 0.0
-            self.voltage = 0.0
+        self.enable = False  # Pin states are read on the first call to check()
+        self.power = False
+
+    def check(self, reading=None, levels=None):
+        """Read the enable and power pin states, and the current and voltage from the LTC4151.
+
+           :param reading: A tuple of (current, voltage) already read from this LTC4151 (by Status.check()), or
+                           None to read them from the I2C bus here.
+           :param levels: The states of all the GPIO pins, as returned by gpio_read_all() (by Status.check()), or
+                          None to read them here.
+        """
+        if levels is None:
+            levels = gpio_read_all()
+        self.enable = bool((levels >> self.enable_pin) & 1)
+        self.power = bool((levels >> self.power_pin) & 1)
+        if reading is None:
+            try:
+                current, voltage = decode_ltc4151(self.bus.read_i2c_block_data(self.address, 0, 4))
+                reading = (current[0], voltage[0])
+            except IOError:
+                reading = (0.0, 0.0)
+        self.current, self.voltage = float(reading[0]), float(reading[1])
 
     def __repr__(self):
-        return "BF# %d: power=%3s, enable=%3s, voltage=%5.2f V, current=%4.0f mA" % (self.bfnum,
-                                                                                     BDICT[self.power],
-                                                                                     BDICT[self.enable],
-                                                                                     self.voltage,
-                                                                                     self.current * 1000)
+        return _BF_FMT % (self.bfnum, BDICT[self.power], BDICT[self.enable], self.voltage, self.current * 1000)
 
 
 class Status(object):
     def __init__(self):
         self.bfs = {}
-        self.power48 = bool(GPIO.input(POWER48))
+        self.power48 = gpio_read(POWER48)
         self.alarmpower = None
         self.alarm48 = None
-        bus = smbus.SMBus(1)  # Initialise the I2C bus and save the connection object
+        self.bus = _get_bus()
+        # The I2C messages used by read_all(), built once and re-used for every poll. For each LTC4151 in turn, set
+        # the register pointer to 0, then read registers 0-3.
+        self.i2c_msgs = []
+        for bfnum in range(1, 9):
+            address = DOCstatus.ADDRESSES[bfnum]
+            self.i2c_msgs.append(i2c_msg.write(address, [0]))
+            self.i2c_msgs.append(i2c_msg.read(address, 4))
         for bfnum in range(1, 9):
-            self.bfs[bfnum] = DOCstatus(bus=bus, bfnum=bfnum)
+            self.bfs[bfnum] = DOCstatus(bus=self.bus, bfnum=bfnum)
         self.check()
 
+    def read_all(self):
+        """Read registers 0-3 (current and voltage) from all eight LTC4151's in a single combined I2C transaction.
+
+           If any of the chips fails to respond, the whole transaction fails, and None is returned, so the caller
+           can fall back to reading each chip individually.
+
+           :return: A tuple of (current, voltage) arrays, indexed by bfnum-1, or None on error.
+        """
+        msgs = self.i2c_msgs
+        try:
+            self.bus.i2c_rdwr(*msgs)
+        except IOError:
+            return None
+        return decode_ltc4151([list(msgs[2 * bfnum - 1]) for bfnum in range(1, 9)])
+
     def check(self):
-        self.alarmpower = bool(GPIO.input(ALARMPOWER))
-        self.alarm48 = bool(GPIO.input(ALARM48))
+        levels = gpio_read_all()  # Read all the pin states once, and use them for every DOC card
+        self.alarmpower = bool((levels >> ALARMPOWER) & 1)
+        self.alarm48 = bool((levels >> ALARM48) & 1)
 
+        readings = self.read_all()
         pled = 1
         eled = 1
-        for bfnum in range(1, 9):
-            self.bfs[bfnum].check()
-            if not self.bfs[bfnum].power:
+        for bfnum, bf in self.bfs.items():
+            if readings is None:
+                bf.check(levels=levels)  # Read each LTC4151 separately, so one missing chip doesn't affect the others
+            else:
+                bf.check(reading=(readings[0][bfnum - 1], readings[1][bfnum - 1]), levels=levels)
+            if not bf.power:
 #                logger.debug('power on port %d is off' % bfnum)
                 pled = 0
-            if not self.bfs[bfnum].enable:
+            if not bf.enable:
 #                logger.debug('enable on port %d is off' % bfnum)
                 eled = 0
-        GPIO.output(DIGOUT1, pled)
-        GPIO.output(DIGOUT2, eled)
+        gpio_write(DIGOUT1, pled)
+        gpio_write(DIGOUT2, eled)
 
     def __repr__(self):
-        rets = "EDA Status: 48V=%3s (Alarm=%3s)\n" % (BDICT[self.power48], BDICT[self.alarm48])
-        rets += "  Beamformers:\n"
-        for bfnum in range(1, 9):
-            rets += '    ' + repr(self.bfs[bfnum]) + '\n'
-        return rets
+        parts = [_STATUS_FMT % (BDICT[self.power48], BDICT[self.alarm48])]
+        parts.extend(_BF_LINE_FMT % (bf.bfnum, BDICT[bf.power], BDICT[bf.enable], bf.voltage, bf.current * 1000)
+                     for bf in self.bfs.values())
+        return ''.join(parts)
+
+
+def gpio_read(pin):
+    """Returns the current state of the given GPIO pin, as a bool.
+    """
+    return bool(PI.read(pin))
+
+
+def gpio_read_all():
+    """Returns the current state of all the GPIO pins (0-31) as an integer, with bit N set if pin N is high.
+    """
+    return PI.read_bank_1()
+
+
+def gpio_write(pin, value):
+    """Sets the given GPIO output pin high (if value is true) or low.
+    """
+    PI.write(pin, 1 if value else 0)
 
 
 def init():
     """Initialise IO pins for power/enable control with all 8 beamformers,
        and create the global STATUS object.
     """
-    global STATUS
-    GPIO.setmode(GPIO.BOARD)  # Use board connector pin numbers to specify I/O pins
-    GPIO.setwarnings(False)
-    GPIO.setup(POWER48, GPIO.OUT)
-    GPIO.setup(ALARMPOWER, GPIO.IN)
-    GPIO.setup(ALARM48, GPIO.IN)
-    GPIO.setup(DIGOUT1, GPIO.OUT)
-    GPIO.setup(DIGOUT2, GPIO.OUT)
-    GPIO.setup(DIGIN1, GPIO.IN)
+    global STATUS, PI
+    PI = pigpio.pi()
+    if not PI.connected:
+        logger.critical("Can't connect to the pigpiod daemon - make sure it's running.")
+        sys.exit(-3)
+    PI.set_mode(POWER48, pigpio.OUTPUT)
+    PI.set_mode(ALARMPOWER, pigpio.INPUT)
+    PI.set_mode(ALARM48, pigpio.INPUT)
+    PI.set_mode(DIGOUT1, pigpio.OUTPUT)
+    PI.set_mode(DIGOUT2, pigpio.OUTPUT)
+    PI.set_mode(DIGIN1, pigpio.INPUT)
     for i in range(1, 9):
         enable, power = BFIOPINS[i]
-        GPIO.setup(enable, GPIO.OUT)
-        GPIO.setup(power, GPIO.OUT)
+        PI.set_mode(enable, pigpio.OUTPUT)
+        PI.set_mode(power, pigpio.OUTPUT)
+    for pin in [ALARMPOWER, ALARM48, DIGIN1]:
+        PI.set_glitch_filter(pin, 50000)  # Ignore pulses shorter than 50ms
+        PI.callback(pin, pigpio.EITHER_EDGE, alarm_callback)
     STATUS = Status()
 
 
-def get_hostname():
-    if sys.version_info.major == 2:
-        output = subprocess.check_output(['hostname'], shell=False)
-    else:
-        output = subprocess.check_output(['hostname'], shell=False).decode('UTF-8')
-    return output.strip().split('.')[0]
+# noinspection PyUnusedLocal
+def alarm_callback(gpio, level, tick):
+    """Called in the pigpio callback thread whenever one of the alarm or digital input pins changes state. Wakes
+       up the main loop, so the new status is checked and logged immediately.
 
+       :param gpio: the pin number that changed state.
+       :param level: the new state of the pin.
+       :param tick: the time of the change, in microseconds since boot.
+    """
+    logger.warning("Input pin %d changed state to %d" % (gpio, level))
+    ALARM_EVENT.set()
+
+
+def get_hostname():
+    """Returns the hostname, with domain stripped off. Used to check that we're running on an edaNmc host.
+    """
+    return socket.gethostname().split('.')[0]
 
 
 def turn_on_48():
-    if True in [x.enable for x in STATUS.bfs.values()]:
+    bfs = STATUS.bfs.values()
+    if any(x.enable for x in bfs):
         for bfnum in range(1, 9):
-            disable_doc(bfnum)
-    if True in [x.power for x in STATUS.bfs.values()]:
+            disable_doc(bfnum, refresh=False)
+    if any(x.power for x in bfs):
         for bfnum in range(1, 9):
-            turnoff_doc(bfnum)
+            turnoff_doc(bfnum, refresh=False)
     time.sleep(0.2)
-    GPIO.output(POWER48, 1)
+    gpio_write(POWER48, 1)
     time.sleep(0.1)
-    STATUS.power48 = bool(GPIO.input(POWER48))
+    STATUS.power48 = gpio_read(POWER48)
+    STATUS.check()
     return (STATUS.power48 is True)
 
 
 def turn_off_48():
-    if True in [x.enable for x in STATUS.bfs.values()]:
+    bfs = STATUS.bfs.values()
+    if any(x.enable for x in bfs):
         for bfnum in range(1, 9):
-            disable_doc(bfnum)
+            disable_doc(bfnum, refresh=False)
         time.sleep(1)  # Wait for a bit after disabling DOC cards, before turning off their power
-    if True in [x.power for x in STATUS.bfs.values()]:
+    if any(x.power for x in bfs):
         for bfnum in range(1, 9):
-            turnoff_doc(bfnum)
-    GPIO.output(POWER48, 0)
+            turnoff_doc(bfnum, refresh=False)
+    gpio_write(POWER48, 0)
     time.sleep(0.1)
-    STATUS.power48 = bool(GPIO.input(POWER48))
+    STATUS.power48 = gpio_read(POWER48)
+    STATUS.check()
     return (STATUS.power48 is False)
 
 
-def turnon_doc(bfnum=0):
-    if bfnum < 1 or bfnum > 8:
-        logger.error("Invalid bfnum - must be 1-8")
-        return None
-    else:
-        if not STATUS.power48:
-            logger.error("Must turn on main 48V power before attempting to power up a DOC card")
+def _validate_bf(func):
+    """Decorator for the functions that control a single DOC card. Checks that the bfnum argument is in the range
+       1-8, and if so, calls the function with the enable and power pin numbers for that card as extra arguments.
+       If not, logs an error and returns None.
+
+       The decorated functions all take a 'refresh' keyword argument (default True). If it's False, the
+       STATUS.check() call at the end is skipped, so that functions changing all eight cards at once can call
+       STATUS.check() just once, at the end.
+    """
+    @functools.wraps(func)
+    def wrapper(bfnum=0, **kwargs):
+        if not (1 <= bfnum <= 8):
+            logger.error("Invalid bfnum - must be 1-8")
             return None
-        if STATUS.bfs[bfnum].enable:
-            disable_doc(bfnum)
-            time.sleep(0.1)
-        GPIO.output(BFIOPINS[bfnum][1], 1)
-        time.sleep(0.1)
-        STATUS.bfs[bfnum].power = bool(GPIO.input(BFIOPINS[bfnum][1]))
-        STATUS.check()
-        return (STATUS.bfs[bfnum].power is True)
+        enable_pin, power_pin = _BF_TABLE[bfnum]
+        return func(bfnum, enable_pin, power_pin, **kwargs)
+    return wrapper
 
 
-def turnoff_doc(bfnum=0):
-    if bfnum < 1 or bfnum > 8:
-        logger.error("Invalid bfnum - must be 1-8")
+@_validate_bf
+def turnon_doc(bfnum, enable_pin, power_pin, refresh=True):
+    if not STATUS.power48:
+        logger.error("Must turn on main 48V power before attempting to power up a DOC card")
         return None
-    else:
-        disable_doc(bfnum)
+    if STATUS.bfs[bfnum].enable:
+        disable_doc(bfnum, refresh=False)
         time.sleep(0.1)
-        GPIO.output(BFIOPINS[bfnum][1], 0)
-        time.sleep(0.1)
-        STATUS.bfs[bfnum].power = bool(GPIO.input(BFIOPINS[bfnum][1]))
+    gpio_write(power_pin, 1)
+    time.sleep(0.1)
+    STATUS.bfs[bfnum].power = gpio_read(power_pin)
+    if refresh:
         STATUS.check()
-        return (STATUS.bfs[bfnum].power is False)
+    return (STATUS.bfs[bfnum].power is True)
 
 
-def enable_doc(bfnum=0):
-    if bfnum < 1 or bfnum > 8:
-        logger.error("Invalid bfnum - must be 1-8")
+@_validate_bf
+def turnoff_doc(bfnum, enable_pin, power_pin, refresh=True):
+    disable_doc(bfnum, refresh=False)
+    time.sleep(0.1)
+    gpio_write(power_pin, 0)
+    time.sleep(0.1)
+    STATUS.bfs[bfnum].power = gpio_read(power_pin)
+    if refresh:
+        STATUS.check()
+    return (STATUS.bfs[bfnum].power is False)
+
+
+@_validate_bf
+def enable_doc(bfnum, enable_pin, power_pin, refresh=True):
+    if not STATUS.power48:
+        logger.error("Must turn on main 48V power, and power to a DOC card, before it can be enabled")
         return None
-    else:
-        if not STATUS.power48:
-            logger.error("Must turn on main 48V power, and power to a DOC card, before it can be enabled")
-            return None
-        if not STATUS.bfs[bfnum].power:
-            logger.error("Must turn on power to a doc before enabling it")
-            return None
-        GPIO.output(BFIOPINS[bfnum][0], 1)
-        time.sleep(0.01)
-        STATUS.bfs[bfnum].enable = bool(GPIO.input(BFIOPINS[bfnum][0]))
+    if not STATUS.bfs[bfnum].power:
+        logger.error("Must turn on power to a doc before enabling it")
+        return None
+    gpio_write(enable_pin, 1)
+    time.sleep(0.01)
+    STATUS.bfs[bfnum].enable = gpio_read(enable_pin)
+    if refresh:
         STATUS.check()
-        return (STATUS.bfs[bfnum].enable is True)
+    return (STATUS.bfs[bfnum].enable is True)
 
 
-def disable_doc(bfnum=0):
-    if bfnum < 1 or bfnum > 8:
-        logger.error("Invalid bfnum - must be 1-8")
-    else:
-        GPIO.output(BFIOPINS[bfnum][0], 0)
-        time.sleep(0.01)
-        STATUS.bfs[bfnum].enable = bool(GPIO.input(BFIOPINS[bfnum][0]))
+@_validate_bf
+def disable_doc(bfnum, enable_pin, power_pin, refresh=True):
+    gpio_write(enable_pin, 0)
+    time.sleep(0.01)
+    STATUS.bfs[bfnum].enable = gpio_read(enable_pin)
+    if refresh:
         STATUS.check()
-        return (STATUS.bfs[bfnum].enable is False)
+    return (STATUS.bfs[bfnum].enable is False)
 
 
 def turnon():
+    """Turn on the 48V supply, then power up each of the DOC cards in turn, then enable them all.
+
+       The cards are still powered up one at a time (turnon_doc() waits 0.1 seconds after each one) to spread out
+       the inrush current, but the settling time before enabling them is only waited for once, not once per card.
+    """
     turn_on_48()
     time.sleep(0.5)
     for bfnum in range(1, 9):
-        turnon_doc(bfnum)
-        time.sleep(0.1)
-        enable_doc(bfnum)
-    GPIO.output(DIGOUT1, 1)
-    GPIO.output(DIGOUT2, 1)
+        turnon_doc(bfnum, refresh=False)
+    time.sleep(0.1)
+    for bfnum in range(1, 9):
+        enable_doc(bfnum, refresh=False)
+    STATUS.check()
+    gpio_write(DIGOUT1, 1)
+    gpio_write(DIGOUT2, 1)
 
 
 def turnoff():
+    """Disable all of the DOC cards, then turn off the power to each one, then turn off the 48V supply.
+    """
     for bfnum in range(1, 9):
-        disable_doc(bfnum)
-        time.sleep(0.1)
-        turnoff_doc(bfnum)
+        disable_doc(bfnum, refresh=False)
+    time.sleep(0.1)
+    for bfnum in range(1, 9):
+        turnoff_doc(bfnum, refresh=False)
     turn_off_48()
-    GPIO.output(DIGOUT1, 0)
-    GPIO.output(DIGOUT2, 0)
+    gpio_write(DIGOUT1, 0)
+    gpio_write(DIGOUT2, 0)
 
 
 def cleanup():
     logger.info("Turning off all eight beamformers, and 48V supplies")
     turnoff()
-    logger.info("Cleaning up GPIO library")
-    GPIO.cleanup()
+    logger.info("Closing pigpio connection")
+    if PI is not None:
+        PI.stop()
 
 
 def SignalHandler(signum=None, frame=None):
@@ -363,7 +517,17 @@ if __name__ == '__main__':
     logger.info("Turning on 48V supplies and all eight beamformers")
     turnon()
 
+    nextcheck = time.monotonic()
     while True:
+        t0 = time.monotonic()
         STATUS.check()
         logger.info(str(STATUS))
-        time.sleep(10)
+        dt = time.monotonic() - t0
+        if dt > SLOW_CHECK:
+            logger.warning("Status check took %4.2f seconds" % dt)
+        # Sleep until the next regular status check, or until an alarm input changes, whichever comes first. The
+        # regular checks are scheduled every STATUS_INTERVAL seconds, however long each check takes, so they don't drift.
+        while nextcheck <= time.monotonic():
+            nextcheck += STATUS_INTERVAL
+        ALARM_EVENT.wait(timeout=nextcheck - time.monotonic())
+        ALARM_EVENT.clear()
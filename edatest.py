@@ -1,11 +1,13 @@
 
 
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import time
 import warnings
 
 warnings.simplefilter(action='ignore')
 
+import numpy
 import Pyro4
 
 import pointing
@@ -50,23 +52,33 @@ BF F: Naive KD=-26, tried range from -32 - -20, settled on KD=-25
 {'A': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 1}, 'C': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 4}, 'B': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 2}, 'E': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': -2}, 'D': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 1}, 'F': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 2}, 'K': {'A': 57, 'C': 32, 'B': -48, 'E': 26, 'D': -26, 'F': -25, '1': -47, '0': -96, '3': 1, '2': -78, '5': -48, '4': 89, '7': 8, '6': 63, '9': 29, '8': 68}, '1': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': -5}, '0': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 4}, '3': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 2}, '2': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 2}, '5': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': -2}, '4': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': -1}, '7': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 1}, '6': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 1}, '9': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': 4}, '8': {'A': 16, 'C': 16, 'B': 16, 'E': 16, 'D': 16, 'F': 16, '1': 16, '0': 16, '3': 16, '2': 16, '5': 16, '4': 16, '7': 16, '6': 16, '9': 16, '8': -1}}
 >>> et.sendDelays(idelays=idelays)
 >>>
+
+The same thing can be done on a numpy array of delays, with one row per beamformer ('0' to 'F', then 'K'):
+
+>>> darr = et.to_array(idelays)
+>>> darr[:16, [et.IDX[dip] for dip in '012345679ABCDEF']] = 16
+>>> et.sendDelays(idelays=et.from_array(darr))
 """
 
 sys.excepthook = Pyro4.util.excepthook
 Pyro4.config.DETAILED_TRACEBACK = True
 
-OFFSETS = pointing.getOffsets()
+OFFSETS = pointing.getOffsets(asarray=True)
 
 HEXD = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F']
+IDX = dict((h, i) for i, h in enumerate(HEXD))  # Row or column in a delay array for each hex digit
+KROW = 16  # Row in a delay array containing the second stage (Kaelus) delays
 
 KURL = 'PYRO:Kaelus@10.128.2.51:19987'
 BURLS = {'eda1com':'PYRO:eda1com@10.128.2.63:19987', 'eda2com':'PYRO:eda2com@10.128.2.65:19987'}
 TILEID = 0
 
 kproxy = Pyro4.Proxy(KURL)
+kproxy._pyroSerializer = 'msgpack'  # Smaller and faster to encode than the default for the nested idelays dict
 bfproxies = {}
 for clientid, url in BURLS.items():
   bfproxies[clientid] = Pyro4.Proxy(url)
+  bfproxies[clientid]._pyroSerializer = 'msgpack'  # edacom.py only accepts msgpack
 
 
 def getDelays(az=0, el=90):
@@ -101,12 +113,45 @@ def getDelays(az=0, el=90):
   return idelays
 
 
+def to_array(idelays):
+  """Convert an idelays dict (as returned by getDelays()) to a (17,16) numpy array of integers. Rows 0-15 are
+     the first stage beamformers '0' to 'F', and row 16 (KROW) is 'K', the Kaelus delays. Columns are the
+     dipoles (or Kaelus inputs) '0' to 'F'.
+  """
+  arr = numpy.zeros((17, 16), dtype=numpy.int16)
+  for bfid, bfdelays in idelays.items():
+    row = KROW if bfid == 'K' else IDX[bfid]
+    for dipid, delay in bfdelays.items():
+      arr[row, IDX[dipid]] = delay
+  return arr
+
+
+def from_array(arr):
+  """Convert a (17,16) array of delays (as returned by to_array()) back into an idelays dict, ready to pass to
+     sendDelays().
+  """
+  idelays = {}
+  for row, bfid in enumerate(HEXD + ['K']):
+    idelays[bfid] = dict(zip(HEXD, (int(d) for d in arr[row])))
+  return idelays
+
+
 def sendDelays(idelays=None):
+  """Send the given delays (as returned by getDelays()) to the Kaelus beamformer and both sets of first stage
+     beamformers, to take effect two seconds from now.
+
+     Each notify() call blocks until the start time, so they are all made at once, in separate threads, rather
+     than one after another. Returns a dictionary with clientid as key, and the notify() result as value.
+  """
   stime = int(time.time() + 2)
   values = {TILEID: {'X': (None, None, 0.0, 0.0, idelays),
                      'Y': (None, None, 0.0, 0.0, idelays)
                      }
             }
-  kproxy.notify(obsid=0, starttime=stime, stoptime=stime + 8, clientid='Kaelus', rclass='pointing', values=values)
-  for clientid, proxy in bfproxies.items():
-    proxy.notify(obsid=0, starttime=stime, stoptime=stime + 8, clientid=clientid, rclass='pointing', values=values)
+  calls = [('Kaelus', kproxy)] + list(bfproxies.items())
+  with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+    futures = {}
+    for clientid, proxy in calls:
+      futures[clientid] = executor.submit(proxy.notify, obsid=0, starttime=stime, stoptime=stime + 8,
+                                          clientid=clientid, rclass='pointing', values=values)
+    return dict((clientid, future.result()) for clientid, future in futures.items())
@@ -4,9 +4,13 @@
 Runs on the Raspberry Pi connected to the Kaelus beamformer via USB, to send pointing commands, etc.
 """
 
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import os
 import logging
 from logging import handlers
+import queue
 import random
 import sys
 import time
@@ -15,8 +19,10 @@ import astropy
 import astropy.time
 import astropy.units
 from astropy.time import Time
-from astropy.coordinates import SkyCoord, EarthLocation
+from astropy.coordinates import SkyCoord, EarthLocation, AltAz
+from astropy.utils import iers
 
+import numpy
 import serial
 from serial import Serial
 import threading
@@ -33,11 +39,42 @@ LOGLEVEL_CONSOLE = logging.INFO  # Logging level for console messages (INFO, DEB
 LOGLEVEL_LOGFILE = logging.INFO  # Logging level for logfile
 LOGLEVEL_REMOTE = logging.INFO
 LOGFILE = "/tmp/kaeslave.log"
+LOGFLUSH_INTERVAL = 30  # Write buffered log file records out at least this often, in seconds
+
+# The log format doesn't use the thread, process or source file/line attributes of a log record, so don't
+# spend time looking them up for every record.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging._srcfile = None
 
 
 class MWALogFormatter(logging.Formatter):
     def format(self, record):
-        return "%s: time %10.6f - %s" % (record.levelname, time.time(), record.getMessage())
+        # Use the time the message was logged, not the time it was written out by the log listener thread
+        return "%s: time %10.6f - %s" % (record.levelname, record.created, record.getMessage())
+
+
+class LazyRotatingFileHandler(handlers.RotatingFileHandler):
+    """RotatingFileHandler that only checks the file size (a seek and tell on the log file) every
+       ROLLOVER_RECORDS records, or every ROLLOVER_SECONDS seconds, instead of on every record.
+    """
+    ROLLOVER_RECORDS = 512
+    ROLLOVER_SECONDS = 30
+
+    def __init__(self, *args, **kwargs):
+        handlers.RotatingFileHandler.__init__(self, *args, **kwargs)
+        self._records_since_check = 0
+        self._last_check = time.time()
+
+    def shouldRollover(self, record):
+        self._records_since_check += 1
+        if ((self._records_since_check < self.ROLLOVER_RECORDS) and
+                ((time.time() - self._last_check) < self.ROLLOVER_SECONDS)):
+            return False
+        self._records_since_check = 0
+        self._last_check = time.time()
+        return handlers.RotatingFileHandler.shouldRollover(self, record)
 
 
 mwalf = MWALogFormatter()
@@ -45,8 +82,8 @@ mwalf = MWALogFormatter()
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
-fh = handlers.RotatingFileHandler(LOGFILE, maxBytes=1000000000,
-                                  backupCount=5)  # 1 Gb per file, max of five old log files
+fh = LazyRotatingFileHandler(LOGFILE, maxBytes=1000000000,
+                             backupCount=5)  # 1 Gb per file, max of five old log files
 fh.setLevel(LOGLEVEL_LOGFILE)
 fh.setFormatter(mwalf)
 
@@ -54,20 +91,44 @@ ch = logging.StreamHandler()
 ch.setLevel(LOGLEVEL_CONSOLE)
 ch.setFormatter(mwalf)
 
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
+# Buffer log file writes, to save wear on the SD card. The buffer is written out when it has 256 records in it, when
+# an error is logged, every LOGFLUSH_INTERVAL seconds, and on exit.
+mh = handlers.MemoryHandler(capacity=256, flushLevel=logging.ERROR, target=fh, flushOnClose=True)
+mh.setLevel(LOGLEVEL_LOGFILE)
+
+
+def flush_logs():
+    """
+    Runs forever in a background thread, flushing the log file buffer every LOGFLUSH_INTERVAL seconds.
+    """
+    while True:
+        time.sleep(LOGFLUSH_INTERVAL)
+        mh.flush()
+
+
+threading.Thread(target=flush_logs, name='logflush', daemon=True).start()
+
+# Log calls just put the record on a queue, and a background thread writes them out to the handlers, so
+# a slow write to the SD card can't hold up the serial comms with the beamformers.
+log_q = queue.SimpleQueue()
+logger.addHandler(handlers.QueueHandler(log_q))
+listener = handlers.QueueListener(log_q, mh, ch, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
 
 import Pyro4
 
 sys.excepthook = Pyro4.util.excepthook
 Pyro4.config.DETAILED_TRACEBACK = True
-Pyro4.config.SERIALIZERS_ACCEPTED.add('pickle')
 
 import pyslave
 import beamformer
 import pointing
 
+# beamformer.py sets the root logger level to DEBUG when it's imported. Set it back to the lowest level any
+# handler will actually write out, so that logger.isEnabledFor(logging.DEBUG) checks can skip building messages.
+logger.setLevel(min(LOGLEVEL_CONSOLE, LOGLEVEL_LOGFILE))
+
 TILEID = 99
 CLIENTNAME = 'Kaelus'
 
@@ -84,15 +145,80 @@ CPOS = (0.0, 0.0, 0.0)  # Offset from geometric centre, in metres, to use as del
 SLAVEPORT = 19987
 DEVICE0 = '/dev/ttyUSB0'
 DEVICE1 = '/dev/ttyUSB1'
+LATENCY_TIMER = '/sys/bus/usb-serial/devices/%s/latency_timer'  # USB-serial driver latency timer, in milliseconds
+# Set to True to put the USB-serial ports into low-latency mode. It's forced OFF by default, as it always has been,
+# until low-latency mode has been tested with the Kaelus hardware.
+LOW_LATENCY = False
 
 DEFATTEN = 0  # Default channel attenuation, 0-255
 DIPOLEFILE = None  # Filename containing dipole offsets from the centre in metres, or None to use MWA tile spacings
 
 MWAPOS = EarthLocation.from_geodetic(lon="116:40:14.93", lat="-26:42:11.95", height=377.8)
+MWA_ALTAZ = AltAz(location=MWAPOS)  # Built once, and copied with the right obstime for each conversion
+
+# Never try to download IERS tables while pointing - use the tables bundled with astropy instead.
+iers.conf.auto_download = False
 
 # Timeout for PyController comms to the PointingSlave instance
 PS_TIMEOUT = 60
 
+SPIN_TIME = 0.001  # Busy-wait for the last SPIN_TIME seconds before a pointing start time, instead of sleeping
+
+_HEXD_POS = {bfid:i for i, bfid in enumerate(pointing.HEXD)}  # Kaelus channel number for each beamformer ID
+
+AZEL_QUANTUM = 100  # Az/El values are rounded to 1/AZEL_QUANTUM degrees before calculating (and caching) delays
+
+
+def set_low_latency(port):
+    """
+    Set the low-latency mode of the USB-serial adapter, according to the LOW_LATENCY flag.
+
+    If LOW_LATENCY is False (the default), the ASYNC_LOW_LATENCY flag is cleared on the open port with the
+    TIOCSSERIAL ioctl, the same as 'setserial <device> ^low_latency', and the driver's latency_timer is left alone.
+
+    If LOW_LATENCY is True, the delay before the adapter passes received bytes back to us is minimised instead. By
+    default the FTDI chip waits 16ms for more data before sending a partial packet over USB, which adds 16ms to
+    every reply from the beamformer. The driver's latency_timer is set to 1ms via sysfs, and the ASYNC_LOW_LATENCY
+    flag is set.
+
+    Failures are logged, but otherwise ignored.
+
+    :param port: An open serial.Serial instance
+    :return: None
+    """
+    if not LOW_LATENCY:
+        logger.info('Forcing low-latency mode OFF for %s', port.port)
+        try:
+            port.set_low_latency_mode(False)  # TIOCGSERIAL/TIOCSSERIAL with ASYNC_LOW_LATENCY cleared
+        except (IOError, OSError, AttributeError, ValueError):
+            logger.warning('Could not clear low-latency mode for %s', port.port)
+        return
+
+    try:
+        with open(LATENCY_TIMER % os.path.basename(port.port), 'w') as f:
+            f.write('1')
+    except (IOError, OSError):
+        logger.warning('Could not set latency_timer for %s', port.port)
+    try:
+        port.set_low_latency_mode(True)  # TIOCGSERIAL/TIOCSSERIAL with ASYNC_LOW_LATENCY set
+    except (IOError, OSError, AttributeError, ValueError):
+        logger.warning('Could not set low-latency mode for %s', port.port)
+
+
+def wait_until(starttime):
+    """
+    Return at the given unix timestamp (or straight away, if it's already passed). Sleeps until SPIN_TIME seconds
+    before the given time, then busy-waits for the rest, because time.sleep() can overshoot on the Raspberry Pi.
+
+    :param starttime: Time to wait until, as a unix timestamp
+    :return: None
+    """
+    dt = starttime - time.time()
+    if dt > SPIN_TIME:
+        time.sleep(dt - SPIN_TIME)
+    while time.time() < starttime:
+        pass
+
 
 class KaelusBeamformer(object):
     """Represents a single Kaelus beamformer. Two attributes (.X and .Y) contain
@@ -108,6 +234,8 @@ class KaelusBeamformer(object):
         :param dipolefile: File name to read dipole physical locations from.
         """
         self.simulate = simulate
+        # Two worker threads, used to talk to the X and Y beamformer boxes in parallel
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='kbf')
         if not self.simulate:
             try:
                 serial0 = Serial(DEVICE0)  # serial port for X pol board
@@ -115,18 +243,15 @@ class KaelusBeamformer(object):
             except serial.serialutil.SerialException:
                 logger.critical("Error opening serial port, exiting")
                 sys.exit()
+            set_low_latency(serial0)
+            set_low_latency(serial1)
             A = beamformer.Beamformer(serial0, name=DEVICE0)
             B = beamformer.Beamformer(serial1, name=DEVICE1)
 
-            # Create two threads to initialise the X and Y beamformer boxes in parallel. Wait until both
+            # Initialise the X and Y beamformer boxes in parallel, in the worker threads. Wait until both
             # have finished before we exit. We don't know which is X and which is Y until after the initialisation,
             # when we can read the serial numbers.
-            athread = threading.Thread(target=self._init_pol, args=(A,))
-            bthread = threading.Thread(target=self._init_pol, args=(B,))
-            athread.start()
-            bthread.start()
-            athread.join()
-            bthread.join()
+            self._run_both(self._init_pol, A, B)
 
             if 'TX2150200007' in A.BFSerial:
                 self.X = A
@@ -135,7 +260,7 @@ class KaelusBeamformer(object):
                 self.X = B
                 self.Y = A
             else:
-                logger.critical('Unable to find a valid BFSerial value, X/Y polarisations could be wrong: %s, %s' % (A.BFSerial, B.BFSerial))
+                logger.critical('Unable to find a valid BFSerial value, X/Y polarisations could be wrong: %s, %s', A.BFSerial, B.BFSerial)
                 self.X = A
                 self.Y = B
 
@@ -151,14 +276,44 @@ class KaelusBeamformer(object):
             self.channels = []
 
         self.offsets = pointing.getOffsets(dipolefile=dipolefile)  # Read dipole offsets in from file
+        self.offsets_arr = pointing.offsets_array(self.offsets)  # Same offsets, as a (16, 16, 3) numpy array
+        self._hexd = pointing.HEXD  # Beamformer IDs, in Kaelus channel order
+
+    def _run_both(self, func, pol1, pol2, *args):
+        """
+        Call func(pol1, *args) and func(pol2, *args) at the same time, and wait for them both to finish. func(pol1)
+        runs in a worker thread, and func(pol2) runs in the calling thread, which would otherwise just be waiting.
+
+        :param func: A method taking a beamformer.Beamformer instance as its first argument
+        :param pol1: An instance of beamformer.Beamformer
+        :param pol2: An instance of beamformer.Beamformer
+        :param args: Any extra arguments to pass to func
+        :return: A tuple of the two results
+        """
+        future = self.pool.submit(func, pol1, *args)
+        try:
+            result2 = func(pol2, *args)
+        finally:
+            result1 = future.result()  # Always wait for the worker to finish with pol1, even if func(pol2) failed
+        return result1, result2
+
+    def close(self):
+        """
+        Close the connections to the X and Y beamformer boxes, and shut down the worker threads.
+        """
+        for pol in self.channels:
+            with pol.lock:
+                pol.CloseConnection()
+        self.pool.shutdown(wait=True)
 
     def _init_pol(self, pol):
         """
-        Initialise one physical Kaelus component (X or Y)
+        Initialise one physical Kaelus component (X or Y), and open the connection to it. The connection
+        is left open until close() is called.
 
         :param pol: An instance of beamformer.Beamformer, either self.X or self.Y
         """
-        logger.info("Initialising %s" % pol.name)
+        logger.info("Initialising %s", pol.name)
         with pol.lock:
             pol.OpenConnection()
             pol.ClearAlarms()
@@ -169,9 +324,25 @@ class KaelusBeamformer(object):
             pol.ChannelAttenuators = [DEFATTEN] * 16
             pol.UpdateSettingsDiagnostics()
             pol.ReadAll()
-            pol.PrintInfo(diag=1)
-            pol.CloseConnection()
-        logger.info("%s initialisation finished." % pol.name)
+            if logger.isEnabledFor(logging.DEBUG):   # Printing the status re-reads everything from the hardware
+                pol.PrintInfo(diag=1)
+        logger.info("%s initialisation finished.", pol.name)
+
+    @functools.lru_cache(maxsize=4096)
+    def _cached_delays(self, az_q, el_q, cpos):
+        """
+        Return the output of pointing.calc_delays() for the given quantised azimuth and elevation, calculating
+        it only if we haven't been asked for the same values (and centre position) before.
+
+        The returned dict is shared between calls, so it must not be modified by the caller.
+
+        :param az_q: Azimuth, in units of 1/AZEL_QUANTUM degrees (an integer)
+        :param el_q: Elevation, in units of 1/AZEL_QUANTUM degrees (an integer)
+        :param cpos: A tuple of three floats, the offset from the geometric centre to use as the delay centre.
+        :return: A tuple of (delays, diagnostics), as returned by pointing.calc_delays()
+        """
+        return pointing.calc_delays(offsets=self.offsets, az=az_q / AZEL_QUANTUM, el=el_q / AZEL_QUANTUM,
+                                    verbose=True, strict=STRICT, cpos=cpos, offsets_arr=self.offsets_arr)
 
     def onlybfs(self, bfids=None):
         """Set which of the MWA beamformers contribute to the EDA output. Unused inputs
@@ -193,31 +364,30 @@ class KaelusBeamformer(object):
         if bfids is None:
             logger.info('Enabling all channels')
             enables = [15] * 16
-        elif (type(bfids) == list) or (isinstance(bfids, STR_CLASS)):
+        elif isinstance(bfids, (list, STR_CLASS)):
             enables = [0] * 16
             onlybfs = []
             for bfid in bfids:
                 if (isinstance(bfid, STR_CLASS)) and (len(bfid) == 1):
-                    if bfid.upper() in pointing.HEXD:
+                    if bfid.upper() in _HEXD_POS:
                         onlybfs.append(bfid.upper())
-                        enables[pointing.HEXD.index(bfid.upper())] = 15
+                        enables[_HEXD_POS[bfid.upper()]] = 15
                     else:
-                        logger.error("Invalid BFID code: %s" % bfid)
+                        logger.error("Invalid BFID code: %s", bfid)
                         return False
                 else:
-                    logger.error("Invalid BFID: %s" % bfid)
+                    logger.error("Invalid BFID: %s", bfid)
                     return False
 
-        logger.info('Enabling only beamformers: %s' % bfids)
+        logger.info('Enabling only beamformers: %s', bfids)
         for pol in [self.X, self.Y]:
             with pol.lock:
                 pol.ChannelEnableDiag = enables
-                pol.OpenConnection()
                 pol.UpdateSettingsDiagnostics()
                 pol.ReadAll()
-                pol.PrintInfo(diag=1)
-                pol.CloseConnection()
-        logger.info('Finished KaelusBeamformer.only1bf(bfids=%s) --> %s, %s' % (bfids, onlybfs, enables))
+                if logger.isEnabledFor(logging.DEBUG):   # Printing the status re-reads everything from the hardware
+                    pol.PrintInfo(diag=1)
+        logger.info('Finished KaelusBeamformer.only1bf(bfids=%s) --> %s, %s', bfids, onlybfs, enables)
         ONLYBFs = onlybfs
         return True
 
@@ -233,19 +403,18 @@ class KaelusBeamformer(object):
                 elif pol is self.Y:
                     enables[1] = 1
                 pol.ChannelEnableDiag = enables
-                pol.OpenConnection()
                 pol.UpdateSettingsDiagnostics()
                 pol.ReadAll()
-                pol.PrintInfo(diag=1)
-                pol.CloseConnection()
+                if logger.isEnabledFor(logging.DEBUG):   # Printing the status re-reads everything from the hardware
+                    pol.PrintInfo(diag=1)
         logger.info('Finished KaelusBeamformer.MarcinHack with 2Y and 5X enabled.')
         return True
 
     def doPointing(self, starttime=0, xaz=0.0, xel=90.0, xdelays=None):
         """Given coordinates or delay settings, repoint the tile.
 
-           NOTE that yaz and yel are ignored - only xaz and xel parameters are used to point BOTH polarisations. This is to
-           save time, as the delay calculations can significant length of time on a Raspberry Pi.
+           NOTE that only the xaz, xel and xdelays parameters are used, to point BOTH polarisations. This is to
+           save time, as the delay calculations can take a significant length of time on a Raspberry Pi.
 
            The X and Y polarisations are pointed in independent threads in parallel, to save time.
 
@@ -257,34 +426,29 @@ class KaelusBeamformer(object):
            :param xdelays: raw delays - either None (to use az/el), or a dict (full EDA delays, as returned by pointing.calc_delays()
            :return: True on success, False if there was a problem with the parameters
         """
-        if xdelays and (type(xdelays) == dict):  # If delays is a dict, they are EDA delays, so use them. If a list, they are normal MWA tile delays
+        if xdelays and isinstance(xdelays, dict):  # If delays is a dict, they are EDA delays, so use them. If a list, they are normal MWA tile delays
             logger.info("Received raw delays to send to beamformers")
-            ydelays = xdelays
         else:
-            xdelays, diagnostics = pointing.calc_delays(offsets=self.offsets, az=xaz, el=xel, verbose=True,
-                                                        strict=STRICT, cpos=CPOS)
+            az_q = int(round(xaz * AZEL_QUANTUM))
+            el_q = int(round(xel * AZEL_QUANTUM))
+            xdelays, diagnostics = self._cached_delays(az_q, el_q, CPOS)
             if diagnostics is not None:
                 delays, delayerrs, sqe, maxerr, offcount = diagnostics
                 if offcount > 0:
-                    logger.warning('Elevation low - %d dipoles disabled because delays were too large to reach in hardware.' % offcount)
-            ydelays = xdelays
-        if (xdelays is None) or (ydelays is None):
+                    logger.warning('Elevation low - %d dipoles disabled because delays were too large to reach in hardware.', offcount)
+        if xdelays is None:
             return False
 
         if self.simulate:
             return None
         else:
-            self.X.ChannelDelay = [xdelays['K'][bfid] + 128 for bfid in pointing.HEXD]  # Add 128 to rescale from signed (-128 to +127) values
-            self.Y.ChannelDelay = [ydelays['K'][bfid] + 128 for bfid in pointing.HEXD]
-            now = time.time()
-            if starttime > now:
-                time.sleep(starttime - now)
-            xthread = threading.Thread(target=self._point_pol, args=(self.X,))
-            ythread = threading.Thread(target=self._point_pol, args=(self.Y,))
-            xthread.start()
-            ythread.start()
-            xthread.join()
-            ythread.join()
+            # Add 128 to rescale from signed (-128 to +127) values
+            hexd = self._hexd
+            xk = xdelays['K']
+            kdelays = (numpy.array([xk[bfid] for bfid in hexd], dtype=numpy.int16) + 128).astype(numpy.uint8).tobytes()
+            self.X.ChannelDelay = kdelays   # Same (immutable) delays for both polarisations
+            self.Y.ChannelDelay = kdelays
+            self._run_both(self._point_pol, self.X, self.Y, starttime)
             #      self.LogAlarms()    # TODO - Comms errors when reading alarms, since the lightning strike in Jan 2017. Re-enable after repairs?
             return True
 
@@ -297,14 +461,10 @@ class KaelusBeamformer(object):
         """
         print("Beamformer status for X-pol:")
         with self.X.lock:
-            self.X.OpenConnection()
             self.X.PrintInfo(diag)
-            self.X.CloseConnection()
         print("\n\nBeamformer status for Y-pol:")
         with self.Y.lock:
-            self.Y.OpenConnection()
             self.Y.PrintInfo(diag)
-            self.Y.CloseConnection()
         print('\n')
 
     def LogAlarms(self):
@@ -314,30 +474,29 @@ class KaelusBeamformer(object):
         :return: None
         """
         with self.X.lock:
-            self.X.OpenConnection()
             self.X.ReadAlarms()
-            self.X.CloseConnection()
-        logger.info("Alarm status for X-pol: %s" % self.X.AlarmStatus)
+        logger.info("Alarm status for X-pol: %s", self.X.AlarmStatus)
         with self.Y.lock:
-            self.Y.OpenConnection()
             self.Y.ReadAlarms()
-            self.Y.CloseConnection()
-        logger.info("Alarm status for Y-pol: %s" % self.Y.AlarmStatus)
+        logger.info("Alarm status for Y-pol: %s", self.Y.AlarmStatus)
 
-    def _point_pol(self, pol):
+    def _point_pol(self, pol, starttime=0):
         """
-        Point the given polarisation (self.X or self.Y) using the previously supplied delay switch settings
+        Point the given polarisation (self.X or self.Y) using the previously supplied delay switch settings.
+
+        The new delays are loaded into the beamformer straight away, but only activated at the given start time,
+        so that the serial traffic for the delay values happens before the start time, not after it.
 
         :param pol: An instance of beamformer.Beamformer, either self.X or self.Y
+        :param starttime: If supplied, wait until this unix timetamp before activating the new delays
         :return:
         """
-        logger.debug("Pointing %s" % pol.name)
+        logger.debug("Pointing %s", pol.name)
         with pol.lock:
-            pol.OpenConnection()
-            pol.SetDelaySwitches()
+            pol.SetDelaySwitches(update=False)
+            wait_until(starttime)
             pol.UpdateDelays()
-            pol.CloseConnection()
-        logger.info("Pointed %s" % pol.name)
+        logger.info("Pointed %s", pol.name)
 
 
 def calc_azel(ra=0.0, dec=0.0, calctime=None):
@@ -355,10 +514,8 @@ def calc_azel(ra=0.0, dec=0.0, calctime=None):
         azeltime = Time.now()
     else:
         azeltime = Time(calctime, format='unix', scale='utc')
-    coords.location = MWAPOS
-    coords.obstime = azeltime
-    cpos = coords.transform_to('altaz')
-    return cpos.az.deg, cpos.alt.deg
+    cpos = coords.transform_to(MWA_ALTAZ.replicate(obstime=azeltime))
+    return float(cpos.az.deg), float(cpos.alt.deg)
 
 
 class PointingSlave(pyslave.Slave):
@@ -394,7 +551,7 @@ class PointingSlave(pyslave.Slave):
           tileid of 0, and are always recognised
        """
         self.tileid = self.orig_tileid
-        logger.warning('Tracking enabled, current tile ID restored to %d' % self.tileid)
+        logger.warning('Tracking enabled, current tile ID restored to %d', self.tileid)
         return True
 
     @Pyro4.expose
@@ -413,7 +570,7 @@ class PointingSlave(pyslave.Slave):
     def set_cpos(self, cpos=None):
         """Sets the position of the EDA centre used for delay calculations, relative to the geometric centre.
 
-           If cpos is not None, it must be a tuple of three floats, used as an offset from the geometrical
+           If cpos is not None, it must be a tuple (or list) of three floats, used as an offset from the geometrical
            EDA centre (0,0,0) in the units used in the locations file), in metres.
 
            The state is saved in a global variable, and lasts until the next call to set_cpos().
@@ -424,21 +581,16 @@ class PointingSlave(pyslave.Slave):
         global CPOS
         if cpos is None:
             CPOS = (0.0, 0.0, 0.0)
-        else:
-            if (type(cpos) == tuple) and (len(cpos) == 3):
-                ok = True
-                for element in cpos:
-                    if (type(element) != float) and (type(element) != int):
-                        ok = False
-                if ok:
-                    CPOS = cpos
-                    return True
-                else:
-                    logger.error('Invalid item in argument for set_cpos(%s) call' % cpos)
-                    return False
-            else:
-                logger.error('Invalid argument to set_cpos(%s)' % cpos)
+            return True
+        if not (isinstance(cpos, (tuple, list)) and (len(cpos) == 3)):  # msgpack sends tuples as lists
+            logger.error('Invalid argument to set_cpos(%s)', cpos)
+            return False
+        for element in cpos:
+            if (not isinstance(element, (int, float))) or isinstance(element, bool):  # Don't accept strings or True/False
+                logger.error('Invalid item in argument for set_cpos(%s) call', cpos)
                 return False
+        CPOS = tuple(float(element) for element in cpos)  # Must be hashable, it's part of the delay cache key
+        return True
 
     @Pyro4.expose
     def is_tracking(self):
@@ -505,23 +657,24 @@ class PointingSlave(pyslave.Slave):
             logger.info('Not pointing - MWA tracking disabled, will only point when given tileid=0')
             return self.clientid, obsid, starttime, {self.tileid:(999, False)}  # Tuple of clientid, tileid, starttime, temperature in deg C, and a 'pointing OK' boolean
         else:
-            logger.warning('Not pointing - tileid of %s not in tileset: %s' % (self.tileid, values.keys()))
+            logger.warning('Not pointing - tileid of %s not in tileset: %s', self.tileid, values.keys())
             return self.clientid, obsid, starttime, {self.tileid:(999, False)}  # Tuple of clientid, tileid, starttime, temperature in deg C, and a 'pointing OK' boolean
 
-        if xdelays and (type(xdelays) == dict):
-            logger.info("Received raw delays to send to beamformers for obsid=%s, time=%s" % (obsid, starttime))
+        if xdelays and isinstance(xdelays, dict):
+            logger.info("Received raw delays to send to beamformers for obsid=%s, time=%s", obsid, starttime)
         elif (xra is not None) and (xdec is not None):
-            logger.info("Received RA/Dec=%s/%s for target at obsid=%s, time=%s, calculating Az/El" % (xra, xdec, obsid, starttime))
-            az, el = calc_azel(ra=xra, dec=xdec, calctime=(starttime + ((starttime - stoptime) / 2)))
+            logger.info("Received RA/Dec=%s/%s for target at obsid=%s, time=%s, calculating Az/El", xra, xdec, obsid, starttime)
+            # Calculate the Az/El for the middle of the observation
+            az, el = calc_azel(ra=xra, dec=xdec, calctime=(((starttime + stoptime) / 2) if stoptime else starttime))
             xaz = az
             xel = el
         else:
-            logger.info("Received Az/el for obsid=%s, time %s: az=%s, el=%s" % (obsid, starttime, xaz, xel))
+            logger.info("Received Az/el for obsid=%s, time %s: az=%s, el=%s", obsid, starttime, xaz, xel)
         ok = self.bf.doPointing(starttime=starttime,
                                 xaz=xaz, xel=xel,
                                 xdelays=xdelays)  # Result is True for pointed OK, False for below 'horizon', None for simulated
         self.lastpointing = (starttime, obsid, xra, xdec, xaz, xel, xdelays, -1, ok)  # Note that the offcount value isn't returned from the Kaelus BF, so set it to -1
-        logger.info("Pointed: ok=%s for obsid=%s, time %s: ra=%s,  dec=%s, az=%s, el=%s" % (ok, obsid, starttime, xra, xdec, xaz, xel))
+        logger.info("Pointed: ok=%s for obsid=%s, time %s: ra=%s,  dec=%s, az=%s, el=%s", ok, obsid, starttime, xra, xdec, xaz, xel)
         return self.clientid, obsid, starttime, {self.tileid:(-999, ok)}
 
 
@@ -531,13 +684,12 @@ if __name__ == '__main__':
     if len(sys.argv) > 2:
         CLIENTNAME = sys.argv[2]
 
-    logger.info("Forcing low-latency mode OFF for USB serial devices.")
-    os.system('setserial %s ^low_latency' % DEVICE0)
-    os.system('setserial %s ^low_latency' % DEVICE1)
-
-    calc_azel(ra=0.0, dec=-26.0)  # Run the astropy function once on startup, to preload all the ephemeris data and save time later
+    # Run the astropy function once on startup, to preload all the ephemeris data and save time later. This is done
+    # in the background, while the beamformers are being initialised.
+    threading.Thread(target=calc_azel, kwargs={'ra':0.0, 'dec':-26.0}, name='azelwarmup', daemon=True).start()
 
     KBF = KaelusBeamformer(simulate=SIMULATE)
+    atexit.register(KBF.close)
 
     # Point the BF at the zenith when the daemon starts up:
     KBF.doPointing()
@@ -581,7 +733,5 @@ if __name__ == '__main__':
             while True:
                 time.sleep(10)
         finally:
-            # cleanup
-            pcs.deregister()
-            pcs.exiting = True
-            pcs.pyro_daemon.shutdown()
+            # cleanup - we never registered with the controller (see above), and pyslave.Slave has no deregister()
+            pcs.stop()
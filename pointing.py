@@ -5,16 +5,21 @@ __author__ = 'andrew'
    Written by Andrew Williams (Andrew.Williams@curtin.edu.au)
 """
 
-import copy
 import math
+import multiprocessing
 
-HEXD = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F']
+import numpy
+
+HEXD = ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F')  # A tuple, so nothing can modify it
 C = 0.000299798  # Speed of light in meters/picosecond
 
 HEADROOM = 0  # How many Kaelus delay steps do we keep in reserve to account for cable variation in the 1st-2nd stage coax lengths.
 
 MSTEP = 435.0  # MWA BF delay quantisation in picoseconds
 KSTEP = 92.0  # Kaelus BF delay quantisation in picoseconds
+INV_C = 1.0 / C  # Reciprocals, so the array code can multiply instead of divide
+INV_MSTEP = 1.0 / MSTEP
+INV_KSTEP = 1.0 / KSTEP
 
 MINV1 = -16  # Range of possible physical integer MWA beamformer delays
 MAXV1 = 15
@@ -34,6 +39,11 @@ MAXDELAY = MAXDELAY1 + MAXDELAY2  # Maximum (most positive) possible physical de
 MAXERRORSTRICT = 8.0 / 100 / C  # 8.0cm = 267ps. For 'perfect' pointing, fail the delay calculation if maximum delay error is more than this
 MAXERRORLOOSE = 20.0 / 100 / C  # 20.0cm = 667ps. For 'ok' pointing, fail the delay calculation if maximum delay error is more than this
 
+TRACK_BLOCK = 256  # Number of pointings calculated at once by calc_delays_batch()
+
+KSEARCH = 6  # When optimising, try all Kaelus delays within +/- this many steps of the naive value
+KTRIALS = numpy.arange(-KSEARCH, KSEARCH + 1)  # Offsets from the naive Kaelus delay for each trial, built once at import
+
 # Correction factors - delay offsets, in picoseconds, to be applied to all dipoles connected to each of the given 1st-stage beamformers.
 # These correct for length differences in the cables connecting the outputs of the sixteen first-stage MWA beamformers to the
 # inputs of the Kaelus beamformer. Start with all of these equal to zero, then calibrate on the sky to work out what they should be.
@@ -54,8 +64,11 @@ BFCORRS = {'0':0.0,  # eg, this offset value in picoseconds is added to all dipo
            'E':0.0,
            'F':0.0}
 
+# The same correction factors as a column vector in HEXD order, to add to a (16, 16) [beamformer, dipole] delay array
+BFCORRS_ARR = numpy.array([BFCORRS[bfid] for bfid in HEXD], dtype=numpy.float64)[:, numpy.newaxis]
 
-def getOffsets(dipolefile=None):
+
+def getOffsets(dipolefile=None, asarray=False):
     """Load the dipole positions for this station from the given text file.
 
        Format is, for example:
@@ -76,12 +89,14 @@ def getOffsets(dipolefile=None):
        The offsets are returned as a dict, with keys '0' to 'F' for the sixteen 1st stage beamformers,
        each of which contains a dict with keys '0' to 'F' for the sixteen dipoles connected to that beamformer.
        Each of those values is a tuple (x, y, z).
+
+       If asarray is True, the offsets are returned as a (16, 16, 3) numpy array instead (see offsets_array()).
+       This can be passed to calc_delays() and calc_Kdelays() as the 'offsets' parameter, and saves them
+       converting the dict on every call.
     """
 
     if dipolefile is None:  # Assume the default EDA layout
-        inf = open('locations.txt', 'rt')
-    else:
-        inf = open(dipolefile, 'rt')
+        dipolefile = 'locations.txt'
 
     offsets = {}
     for bfid in HEXD:
@@ -89,34 +104,141 @@ def getOffsets(dipolefile=None):
         for dipid in HEXD:
             offsets[bfid][dipid] = (0.0, 0.0, 0.0)
 
-    for line in inf.readlines():
-        if line.startswith('#'):
-            pass  # Ignore comments
-        else:
-            try:
-                if '#' in line:
-                    line = line[:line.find('#')]
-                values = line.split()
-                if len(values) == 4:
-                    number, xs, ys, zs = values
-                elif len(values) == 3:
-                    number, xs, ys = values
-                    zs = 0.00
-                else:
-                    print("Bad line in file: %s" % line)
-                    continue
-                name = '%02x' % (int(number) - 1)
-                bfid = name[0].upper()
-                dipid = name[1].upper()
-                x, y, z = float(xs), float(ys), float(zs)
-                offsets[bfid][dipid] = (x, y, z)
-            except AssertionError:
-                print("Problem parsing dipole position file %s in line: %s" % (dipolefile, line))
-                return None
-
+    with open(dipolefile, 'rt') as inf:
+        for line in inf:
+            if line.startswith('#'):
+                pass  # Ignore comments
+            else:
+                try:
+                    if '#' in line:
+                        line = line[:line.find('#')]
+                    values = line.split()
+                    if len(values) == 4:
+                        number, xs, ys, zs = values
+                    elif len(values) == 3:
+                        number, xs, ys = values
+                        zs = 0.00
+                    else:
+                        print("Bad line in file: %s" % line)
+                        continue
+                    name = '%02X' % (int(number) - 1)
+                    bfid, dipid = name[0], name[1]
+                    x, y, z = float(xs), float(ys), float(zs)
+                    offsets[bfid][dipid] = (x, y, z)
+                except AssertionError:
+                    print("Problem parsing dipole position file %s in line: %s" % (dipolefile, line))
+                    return None
+
+    if asarray:
+        return offsets_array(offsets)
     return offsets
 
 
+def offsets_array(offsets):
+    """Convert the dipole offsets dict returned by getOffsets() into a numpy array of shape (16, 16, 3), indexed
+       by [beamformer, dipole, axis], with the beamformers and dipoles in HEXD order. The axes are (x, y, z).
+
+       :param offsets: a dict containing the 256 dipole positions in metres, as returned by getOffsets(). If it's
+                       already a numpy array, it's returned unchanged.
+       :return: A read-only numpy float64 array of shape (16, 16, 3)
+    """
+    if isinstance(offsets, numpy.ndarray):
+        return offsets
+    arr = numpy.array([[offsets[bfid][dipid] for dipid in HEXD] for bfid in HEXD], dtype=numpy.float64)
+    arr.flags.writeable = False
+    return arr
+
+
+def _array_to_dict(arr):
+    """Convert a (16, 16) numpy array indexed by [beamformer, dipole] in HEXD order into a dict of dicts, with
+       beamformer ID as the first key and dipole ID as the second.
+    """
+    rows = arr.tolist()
+    return {bfid:dict(zip(HEXD, rows[bi])) for bi, bfid in enumerate(HEXD)}
+
+
+def calc_geometric_delays(offsets_arr, az=0.0, el=90.0, cpos=(0.0, 0.0, 0.0), bfcorrs=True):
+    """Given an azimuth and elevation, return the geometric delay for each dipole in picoseconds, including the
+       BFCORRS correction for the first-stage beamformer it's connected to (unless bfcorrs is False).
+
+       az and el can also be equal-length 1-D arrays, to calculate the delays for a whole track at once.
+
+       :param offsets_arr: a numpy array of dipole positions, of shape (16, 16, 3), as returned by offsets_array()
+       :param az: azimuth (degrees), where 0 is north and it increases clockwise.
+       :param el: elevation (degrees) is the angle up from the horizon.
+       :param cpos: a tuple of (x, y, z) coordinates for the geometric delay centre, in metres - see calc_delays()
+       :param bfcorrs: If True (the default), add the BFCORRS correction factors to the delays
+       :return: A numpy array of shape (16, 16), indexed by [beamformer, dipole] in HEXD order, or (T, 16, 16),
+                indexed by [timestamp, beamformer, dipole] if az and el are arrays of length T.
+    """
+    if numpy.ndim(az) or numpy.ndim(el):
+        azr = numpy.radians(numpy.asarray(az, dtype=numpy.float64))
+        zar = numpy.radians(90 - numpy.asarray(el, dtype=numpy.float64))
+        sin_zar = numpy.sin(zar)
+        # Unit vectors towards the source, one row of (x, y, z) for each timestamp
+        khat = numpy.stack([numpy.sin(azr) * sin_zar, numpy.cos(azr) * sin_zar, numpy.cos(zar)], axis=-1)
+    else:
+        azr = math.radians(az)
+        zar = math.radians(90 - el)
+        sin_zar = math.sin(zar)
+        # Unit vector towards the source, in (x, y, z) order
+        khat = numpy.array([math.sin(azr) * sin_zar, math.cos(azr) * sin_zar, math.cos(zar)])
+    delays = numpy.inner(khat * INV_C, offsets_arr - numpy.asarray(cpos, dtype=numpy.float64))
+    if bfcorrs:
+        delays += BFCORRS_ARR
+    return delays
+
+
+def _calc_kdelays(delays_arr, optimise=True, verbose=False):
+    """The numerical core of calc_delays() - given the geometric delays for each dipole, choose the Kaelus delay for
+       each first stage beamformer. See calc_delays() for a description of the algorithm.
+
+       :param delays_arr: A (16, 16) numpy array of geometric delays in picoseconds, indexed by [beamformer, dipole],
+                          or a (T, 16, 16) array of them, indexed by [timestamp, beamformer, dipole]
+       :param optimise: If True, optimise least-squares error for all dipoles by trying alternate Kaelus delay values.
+       :param verbose: If True, print the naive and chosen Kaelus delay for each beamformer (for a single pointing only).
+       :return: A tuple of (kdelays, delays2), where kdelays is a (16,) int32 array of Kaelus delays, and delays2 is
+                a (16,) float array of the delay in picoseconds that those Kaelus delays represent (or (T, 16) arrays).
+    """
+    kmin, kmax = MINV2 + HEADROOM, MAXV2 - HEADROOM  # Range of Kaelus delay values we can use
+
+    # Allocate as much as possible of the total delay for each dipole to the Kaelus stage 2 delay for that input, by making it equal to the mean total delay for the 16 dipoles on that Kaelus input.
+    delays2 = delays_arr.mean(axis=-1)
+    naivekdelays = numpy.rint(delays2 * INV_KSTEP)  # First draft at the Kaelus delay for each 1st-stage BF
+
+    # If a Kaelus delay is outside the range of possible Kaelus delay values, make it as large/small as possible, and hope the rest of the total delay can be accomodated by the 1st-stage BF
+    kdelays = numpy.clip(naivekdelays, kmin, kmax).astype(numpy.int32)  # Kaelus delays, one for each first-stage beamformer
+    clipped = kdelays != naivekdelays
+    delays2[clipped] = kdelays[clipped] * KSTEP
+
+    if optimise:
+        # Now see if we can optimise the 1st-stage pointing residuals by moving +/-6 Kaelus beamformer delay steps from the MWA BF delays (435ps) to the Kaelus input delay (184ps)
+        # Try all the alternative Kaelus delays for all beamformers at once, calculating the sum of the squares of the differences between the ideal geometric delay, and the quantised integer delays.
+        # Trial arrays are indexed by [beamformer, trial Kaelus delay], or [beamformer, trial Kaelus delay, dipole],
+        # with an extra leading timestamp axis if we've been given a whole track.
+        trials = kdelays[..., numpy.newaxis] + KTRIALS
+        trialdelays2 = (trials * KSTEP)[..., numpy.newaxis]
+        idelay1 = numpy.rint((delays_arr[..., numpy.newaxis, :] - trialdelays2) * INV_MSTEP)
+        sqes = numpy.sum((delays_arr[..., numpy.newaxis, :] - ((idelay1 * MSTEP) + trialdelays2)) ** 2, axis=-1)
+        sqes += 9e99 * numpy.sum((idelay1 < MINV1) | (idelay1 > MAXV1), axis=-1)  # Invalidate trials with dipole delays outside the possible value range
+        sqes[(trials < kmin) | (trials > kmax)] = numpy.inf  # Skip trial Kaelus delays that the hardware can't do
+        best = numpy.argmin(sqes, axis=-1)[..., numpy.newaxis]  # The first trial with the smallest error, for each beamformer
+        # Take the Kaelus delay with the smallest sum-of-squares error and use that, unless there are no valid trials
+        bestkids = numpy.where(numpy.take_along_axis(sqes, best, axis=-1)[..., 0] < 9e99,
+                               numpy.take_along_axis(trials, best, axis=-1)[..., 0],
+                               kdelays).astype(numpy.int32)
+
+        if verbose:
+            print("\n".join(["BF %s: Naive KD=%d, tried range from %d - %d, settled on KD=%d" % (bfid, kdelays[bi],
+                                                                                               max(kmin, kdelays[bi] - KSEARCH),
+                                                                                               min(kmax, kdelays[bi] + KSEARCH),
+                                                                                               bestkids[bi])
+                             for bi, bfid in enumerate(HEXD)]))
+        kdelays = bestkids
+        delays2 = kdelays * KSTEP
+    return kdelays, delays2
+
+
 def calc_delays(offsets=None,
                 az=0.0, el=90.0,
                 verbose=True,
@@ -124,12 +246,14 @@ def calc_delays(offsets=None,
                 strict=True,
                 optimise=True,
                 clipdelays=True,
-                cpos=(0.0, 0.0, 0.0)):
+                cpos=(0.0, 0.0, 0.0),
+                offsets_arr=None):
     """Given an azimuth and elevation, return the delay settings for each dipole.
 
        :param az: azimuth (degrees), where 0 is north and it increases clockwise.
        :param el: elevation (degrees) is the angle up from the horizon.
-       :param offsets: a dict containing the 256 dipole positions in metres, relative to the station centre (0, 0, 0)
+       :param offsets: a dict containing the 256 dipole positions in metres, relative to the station centre (0, 0, 0),
+                     or the same positions as a numpy array, as returned by getOffsets(asarray=True)
        :param verbose: Boolean, indicates some text output (when True) or completely silent (when False)
        :param errorlimit: If the maximum pointing error for any dipole exceeds this value in picoseconds, return (None,None).
        :param strict: If False, dipoles exceeding their maximum delay are disabled. If True, this call will fail if any exceed max delay.
@@ -140,6 +264,8 @@ def calc_delays(offsets=None,
                      dipole offsets. Use this to specify an off-centre geometric delay calculation - for example, if you are
                      only using dipoles in a small cluster near one edge of the EDA, and want to reach lower than 20 degrees
                      away from the zenith. Defaults to (0,0,0).
+       :param offsets_arr: Optional - the same dipole positions as 'offsets', as a numpy array returned by offsets_array().
+                     If not given, it's created from 'offsets'. Pass it in to avoid converting 'offsets' on every call.
 
        Algorith:
           -All 256 dipoles are treated individually, and a geometric delay for each dipole in picoseconds is
@@ -183,125 +309,120 @@ def calc_delays(offsets=None,
           maxerr is the absolute value of the largest dipole delay error, in picoseconds.
 
     """
-    dtor = math.pi / 180.0  # convert degrees to radians
     # define zenith angle
     za = 90 - el
 
-    # Initialise the structures to contain geometric and integer delay values.
-    delays = {}
-    for bfid in HEXD:
-        delays[bfid] = {}
-        for dipid in HEXD:
-            delays[bfid][dipid] = 0.0
-
-    # Initialise the structures to contain the differences between geometric and quantised delay values.
-    delayerrs = {}
-    for bfid in HEXD:
-        delayerrs[bfid] = {}
-        for dipid in HEXD:
-            delayerrs[bfid][dipid] = 0.0
-
-    idelays = {}
-    for bfid in HEXD + ['K']:  # An extra beamformer 'K' to hold Kaelus delays - only necessary for the integer delays
-        idelays[bfid] = {}
-        for dipid in HEXD:
-            idelays[bfid][dipid] = 0.0
-
     # Check input sanity
     if (abs(za) > 90):
         if verbose:
             print("Elevation must be between 0 and 90 degrees")
         return None, None
 
-    # Convert to radians
-    azr = az * dtor
-    zar = za * dtor
-
-    for bfid in HEXD:  # Loop over all first-stage beamformers
-        for dipid in HEXD:  # Loop over each of the 16 dipoles connected to that first-stage beamformer
-            x, y, z = offsets[bfid][dipid]
-            x -= cpos[0]  # Find the difference between the dipole coordinate and the geometric delay centre
-            y -= cpos[1]
-            z -= cpos[2]
-            delay = ((x * math.sin(azr) + y * math.cos(azr)) * math.sin(zar) + (z * math.cos(
-                zar))) / C  # Calculate geometric delays in picoseconds as a signed float, relative to the station centre
-            delay += BFCORRS[bfid]  # Apply a correction factor in picoseconds, unique for each first-stage beamformer
-            delays[bfid][
-                dipid] = delay  # 'delays' contains 256 _total_ delays in picoseconds, one for each dipole, not split into first/second stages
-        # mindelay = min(delays[bfid].values())
-        # maxdelay = max(delays[bfid].values())
-        meandelay = sum(delays[bfid].values()) / 16.0
-
-        # Allocate as much as possible of the total delay for each dipole to the Kaelus stage 2 delay for that input, by making it equal to the mean total delay for the 16 dipoles on that Kaelus input.
-        delay2 = meandelay
-
-        idelays['K'][bfid] = int(round(delay2 / KSTEP))  # First draft at the Kaelus delay for this 1st-stage BF
-
-        # If the Kaelus delay is outside the range of possible Kaelus delay values, make it as large/small as possible, and hope the rest of the total delay can be accomodated by the 1st-stage BF
-        if idelays['K'][bfid] > MAXV2 - HEADROOM:
-            idelays['K'][bfid] = MAXV2 - HEADROOM
-            delay2 = idelays['K'][bfid] * KSTEP
-        elif idelays['K'][bfid] < MINV2 + HEADROOM:
-            idelays['K'][bfid] = MINV2 + HEADROOM
-            delay2 = idelays['K'][bfid] * KSTEP
-
-        if optimise:
-            # Now see if we can optimise the 1st-stage pointing residuals by moving +/-6 Kaelus beamformer delay steps from the MWA BF delays (435ps) to the Kaelus input delay (184ps)
-            # First, make the window +/- 6 steps if possible, or limit the edges of the window to the minimum or maximum Kaelus integer delay value if we are close to the top or bottom.
-            begin = max((MINV2 + HEADROOM), (idelays['K'][bfid] - 6))
-            end = min((MAXV2 - HEADROOM), (idelays['K'][bfid] + 6))
-            # Now loop over the possible alternative Kaelus delays, calculating the sum of the squares of the differences between the ideal geometric delay, and the quantised integer delays.
-            bestkid, bestsqe = idelays['K'][bfid], 9e99
-            for kidelay in range(begin, end + 1):
-                sqe = 0.0
-                for dipid in HEXD:
-                    delay1 = delays[bfid][dipid] - (kidelay * KSTEP)
-                    idelay1 = int(round(delay1 / MSTEP))
-                    if not (MINV1 < idelay1 < MAXV1):  # Optimised dipole delay outside possible value range
-                        sqe += 9e99  # Invalidate this choice of kidelay
-                    sqe += (delays[bfid][dipid] - ((idelay1 * MSTEP) + (kidelay * KSTEP))) ** 2
-                if sqe < bestsqe:
-                    bestkid, bestsqe = kidelay, sqe
-
-            # Take the Kaelus delay with the smallest sum-of-squares error and use that
-            if verbose:
-                print("BF %s: Naive KD=%d, tried range from %d - %d, settled on KD=%d" % (bfid, idelays['K'][bfid], begin, end, bestkid))
-            delay2 = bestkid * KSTEP
-            idelays['K'][bfid] = bestkid
+    if offsets_arr is None:
+        offsets_arr = offsets_array(offsets)
 
-        # Using that optimised Kaelus delay, calculate the integer 1st stage delay values
-        for dipid in HEXD:
-            delay1 = delays[bfid][dipid] - delay2
-            idelays[bfid][dipid] = int(round(delay1 / MSTEP))
-            if clipdelays:
-                if idelays[bfid][dipid] < MINV1:
-                    idelays[bfid][dipid] = MINV1
-                elif idelays[bfid][dipid] > MAXV1:
-                    idelays[bfid][dipid] = MAXV1
+    # The delays are calculated in numpy arrays indexed by [beamformer, dipole] (or just [beamformer] for the Kaelus
+    # delays), in HEXD order, and converted to the nested dicts described above at the end.
+
+    # Calculate all 256 geometric delays in picoseconds as signed floats, relative to the station centre, including the
+    # BFCORRS correction factor for each first-stage beamformer. 'delays_arr' contains 256 _total_ delays in picoseconds,
+    # one for each dipole, not split into first/second stages
+    delays_arr = calc_geometric_delays(offsets_arr, az=az, el=el, cpos=cpos)
+    kdelays, delays2 = _calc_kdelays(delays_arr, optimise=optimise, verbose=verbose)
+
+    return _finish_delays(delays_arr, kdelays, delays2,
+                          verbose=verbose, errorlimit=errorlimit, strict=strict, clipdelays=clipdelays)
+
+
+def _finish_delays(delays_arr, kdelays, delays2=None, idelays_arr=None,
+                   verbose=True, errorlimit=MAXERRORSTRICT, strict=True, clipdelays=True):
+    """Given the geometric delays for a single pointing, and the Kaelus delays chosen by _calc_kdelays(), calculate the
+       first stage delays and the pointing errors, and return them in the format described in calc_delays().
+
+       If idelays_arr is given, those first stage delays are used as they are (and modified in place if any dipoles
+       need to be disabled), instead of calculating them from delays2.
+    """
+    if idelays_arr is None:
+        # Using the optimised Kaelus delays, calculate the integer 1st stage delay values
+        idelays_arr = numpy.rint((delays_arr - delays2[:, numpy.newaxis]) * INV_MSTEP).astype(numpy.int32)  # First stage delays, for each dipole
+        if clipdelays:
+            numpy.clip(idelays_arr, MINV1, MAXV1, out=idelays_arr)
 
     # Calculate a final sum-of-squares error for the differences between ideal geometric and actual quantised, rounded delays, as a measure of pointing quality.
-    sqe = 0.0
-    maxerr = 0.0
-    offcount = 0
-    for bfid in HEXD:
-        for dipid in HEXD:
-            err = (delays[bfid][dipid] - ((idelays[bfid][dipid] * MSTEP) + (idelays['K'][bfid] * KSTEP)))
-            delayerrs[bfid][dipid] = err
-            if abs(err) > maxerr:  # Update the largest error value found in this pointing calculation so far
-                maxerr = abs(err)
-            if abs(err) > errorlimit:  # If any dipole has an error greater than the maximum allowed error, then either disable it, or just fail
-                if strict:
-                    if verbose:
-                        print("BF %s: Dipole %s exceeds maximum error limit: %5.0f > %5.0f" % (bfid, dipid, maxerr, errorlimit))
-                    return None, None
-                if clipdelays:  # Don't disable the dipole if we want to use single-beamformer mode, for example, after normalising delays
-                    idelays[bfid][dipid] = 16  # This disables the dipole, because 16 is added before sending it to the BF hardware
-                offcount += 1  # Add to the count of disabled dipoles
-            sqe += err * err
+    delayerrs_arr = delays_arr - ((idelays_arr * MSTEP) + (kdelays[:, numpy.newaxis] * KSTEP))
+    abserrs = numpy.abs(delayerrs_arr)
+    maxerr = float(abserrs.max())  # The largest error value found in this pointing calculation
+    sqe = float(numpy.sum(delayerrs_arr * delayerrs_arr))
+    toobig = abserrs > errorlimit  # Dipoles with an error greater than the maximum allowed error, to either disable, or just fail
+    offcount = int(toobig.sum())  # Count of disabled dipoles
+    if offcount:
+        if strict:
+            if verbose:
+                bi, di = numpy.argwhere(toobig)[0]  # The first dipole over the limit
+                print("BF %s: Dipole %s exceeds maximum error limit: %5.0f > %5.0f" % (HEXD[bi], HEXD[di],
+                                                                                       abserrs.ravel()[:bi * 16 + di + 1].max(),
+                                                                                       errorlimit))
+            return None, None
+        if clipdelays:  # Don't disable the dipole if we want to use single-beamformer mode, for example, after normalising delays
+            idelays_arr[toobig] = 16  # This disables the dipole, because 16 is added before sending it to the BF hardware
+
+    # Convert the arrays to the nested dicts returned by this function
+    idelays = _array_to_dict(idelays_arr)
+    idelays['K'] = dict(zip(HEXD, kdelays.tolist()))  # An extra beamformer 'K' to hold Kaelus delays - only necessary for the integer delays
+    delays = _array_to_dict(delays_arr)
+    delayerrs = _array_to_dict(delayerrs_arr)
 
     return idelays, (delays, delayerrs, sqe, maxerr, offcount)
 
 
+def calc_delays_batch(offsets=None,
+                      az=(), el=(),
+                      errorlimit=MAXERRORSTRICT,
+                      strict=True,
+                      optimise=True,
+                      clipdelays=True,
+                      cpos=(0.0, 0.0, 0.0)):
+    """Like calc_delays(), but for a whole sequence of pointings (eg, a track) at once. The geometric delays and
+       the Kaelus delay search are done as numpy operations over all the timestamps in each block of TRACK_BLOCK
+       pointings, instead of one pointing at a time.
+
+       Each distinct (az, el) pair is only calculated once - for a drift scan, for example, every line of the track
+       is the same pointing. Repeated pointings share the same result objects, so they mustn't be modified in place.
+
+       :param offsets: a dict containing the 256 dipole positions in metres, or a numpy array (see calc_delays())
+       :param az: a sequence of azimuths (degrees), where 0 is north and it increases clockwise.
+       :param el: a sequence of elevations (degrees), the same length as az
+       :param errorlimit: If the maximum pointing error for any dipole exceeds this value in picoseconds, that
+                     pointing is returned as (None, None).
+       :param strict: See calc_delays()
+       :param optimise: See calc_delays()
+       :param clipdelays: See calc_delays()
+       :param cpos: See calc_delays()
+       :return: A list of (idelays, (delays, delayerrs, sqe, maxerr, offcount)) tuples, one for each (az, el), each
+                exactly as returned by calc_delays() with verbose=False.
+    """
+    offsets_arr = offsets_array(offsets)
+    az = numpy.asarray(az, dtype=numpy.float64)
+    el = numpy.asarray(el, dtype=numpy.float64)
+    if not len(az):
+        return []
+    # Only calculate the distinct pointings, and use 'inverse' to look up the results for the original list
+    azel, inverse = numpy.unique(numpy.stack([az, el], axis=-1), axis=0, return_inverse=True)
+    az, el = azel[:, 0], azel[:, 1]
+    results = []
+    for start in range(0, len(az), TRACK_BLOCK):  # Limit the size of the (T, 16, 13, 16) trial arrays
+        bel = el[start:start + TRACK_BLOCK]
+        delays_arr = calc_geometric_delays(offsets_arr, az=az[start:start + TRACK_BLOCK], el=bel, cpos=cpos)
+        kdelays, delays2 = _calc_kdelays(delays_arr, optimise=optimise, verbose=False)
+        for ti in range(len(bel)):
+            if abs(90 - bel[ti]) > 90:
+                results.append((None, None))
+            else:
+                results.append(_finish_delays(delays_arr[ti], kdelays[ti], delays2[ti],
+                                              verbose=False, errorlimit=errorlimit, strict=strict, clipdelays=clipdelays))
+    return [results[i] for i in inverse.ravel().tolist()]
+
+
 def calc_Kdelays(offsets=None,
                  indelays=None,
                  az=0.0, el=90.0,
@@ -310,7 +431,8 @@ def calc_Kdelays(offsets=None,
                  strict=True,
                  optimise=True,
                  clipdelays=True,
-                 cpos=(0.0, 0.0, 0.0)):
+                 cpos=(0.0, 0.0, 0.0),
+                 offsets_arr=None):
     """Given an azimuth and elevation, and a set of existing integer delays, return the delay settings for each dipole
        with the best RMS error by using ONLY Kaelus (2nd stage) delay changes from the input array, keeping
        MWA BF (1st stage) delays the same..
@@ -318,17 +440,21 @@ def calc_Kdelays(offsets=None,
        :param az: azimuth (degrees), where 0 is north and it increases clockwise.
        :param el: elevation (degrees) is the angle up from the horizon.
        :param indelays: a structure in exactly the same format as the output delay structure from this function or calc_delays.
-       :param offsets: a dict containing the 256 dipole positions in metres, relative to the station centre (0, 0, 0)
+       :param offsets: a dict containing the 256 dipole positions in metres, relative to the station centre (0, 0, 0),
+                     or the same positions as a numpy array, as returned by getOffsets(asarray=True)
        :param verbose: Boolean, indicates some text output (when True) or completely silent (when False)
        :param errorlimit: If the maximum pointing error for any dipole exceeds this value in picoseconds, return (None,None).
        :param strict: If False, dipoles exceeding their maximum delay are disabled. If True, this call will fail if any exceed max delay.
-       :param optimise: If True, optimise least-squares error for all dipoles by trying alternate Kaelus delay values.
+       :param optimise: Accepted for compatibility with calc_delays(). The naive Kaelus delays already have the least-squares
+                     error here, because the MWA BF delays are fixed, so there are no alternate values worth trying.
        :param clipdelays: if True (default), means that MWA beamformer idelays are clipped to -16->+15, otherwise they are returned
                      without clipping so that single-beamformer mode works, for example, after normalising delays.
        :param cpos: a tuple of (x, y, z) coordinates for the geometric delay centre, in metres, relative to the coordinates of the
                      dipole offsets. Use this to specify an off-centre geometric delay calculation - for example, if you are
                      only using dipoles in a small cluster near one edge of the EDA, and want to reach lower than 20 degrees
                      away from the zenith. Defaults to (0,0,0).
+       :param offsets_arr: Optional - the same dipole positions as 'offsets', as a numpy array returned by offsets_array().
+                     If not given, it's created from 'offsets'. Pass it in to avoid converting 'offsets' on every call.
 
        Algorith:
           -All 256 dipoles are treated individually, and a geometric delay for each dipole in picoseconds is
@@ -369,30 +495,9 @@ def calc_Kdelays(offsets=None,
 
           maxerr is the absolute value of the largest dipole delay error, in picoseconds.
     """
-    dtor = math.pi / 180.0  # convert degrees to radians
     # define zenith angle
     za = 90 - el
 
-    # Initialise the structures to contain geometric and integer delay values.
-    delays = {}
-    for bfid in HEXD:
-        delays[bfid] = {}
-        for dipid in HEXD:
-            delays[bfid][dipid] = 0.0
-
-    # Initialise the structures to contain the differences between geometric and quantised delay values.
-    delayerrs = {}
-    for bfid in HEXD:
-        delayerrs[bfid] = {}
-        for dipid in HEXD:
-            delayerrs[bfid][dipid] = 0.0
-
-    idelays = {}
-    for bfid in HEXD + ['K']:  # An extra beamformer 'K' to hold Kaelus delays - only necessary for the integer delays
-        idelays[bfid] = {}
-        for dipid in HEXD:
-            idelays[bfid][dipid] = 0.0
-
     # Check input sanity
     if (abs(za) > 90):
         if verbose:
@@ -404,132 +509,105 @@ def calc_Kdelays(offsets=None,
             "Must pass input delay structure - if you aren't modifying a previously calculated delay set, use calc_delays()")
         return None, None
 
-    # Convert to radians
-    azr = az * dtor
-    zar = za * dtor
-
-    for bfid in HEXD:  # Loop over all first-stage beamformers
-        for dipid in HEXD:  # Loop over each of the 16 dipoles connected to that first-stage beamformer
-            x, y, z = offsets[bfid][dipid]
-            x -= cpos[0]  # Find the difference between the dipole coordinate and the geometric delay centre
-            y -= cpos[1]
-            z -= cpos[2]
-            delay = ((x * math.sin(azr) + y * math.cos(azr)) * math.sin(zar) + (z * math.cos(
-                zar))) / C  # Calculate geometric delays in picoseconds as a signed float, relative to the station centre
-            delays[bfid][
-                dipid] = delay  # 'delays' contains 256 _total_ delays in picoseconds, one for each dipole, not split into first/second stages
-        # mindelay = min(delays[bfid].values())
-        # maxdelay = max(delays[bfid].values())
-        meandelay = sum(delays[bfid].values()) / 16.0
-
-        inmeandelay = sum(indelays[bfid].values()) * MSTEP / 16.0
-        delay2 = meandelay - inmeandelay
-        idelays['K'][bfid] = int(round(delay2 / KSTEP))  # First draft at the Kaelus delay for this 1st-stage BF
-
-        # If the Kaelus delay is outside the range of possible Kaelus delay values, make it as large/small as possible, and hope the rest of the total delay can be accomodated by the 1st-stage BF
-        if idelays['K'][bfid] > MAXV2 - HEADROOM:
-            idelays['K'][bfid] = MAXV2 - HEADROOM
-            # delay2 = idelays['K'][bfid] * KSTEP
-        elif idelays['K'][bfid] < MINV2 + HEADROOM:
-            idelays['K'][bfid] = MINV2 + HEADROOM
-            # delay2 = idelays['K'][bfid] * KSTEP
-
-        if optimise:
-            # Now see if we can optimise the 1st-stage pointing residuals by moving +/-6 Kaelus beamformer delay steps
-            # First, make the window +/- 3 steps if possible, or limit the edges of the window to the minimum or maximum Kaelus interger delay value if we are close to the top or bottom.
-            begin = max((MINV2 + HEADROOM), (idelays['K'][bfid] - 6))
-            end = min((MAXV2 - HEADROOM), (idelays['K'][bfid] + 6))
-            # Now loop over the possible alternative Kaelus delays, calculating the sum of the squares of the differences between the ideal geometric delay, and the quantised integer delays.
-            bestkid, bestsqe = idelays['K'][bfid], 9e99
-            for kidelay in range(begin, end + 1):
-                sqe = 0.0
-                for dipid in HEXD:
-                    sqe += (delays[bfid][dipid] - ((indelays[bfid][dipid] * MSTEP) + (kidelay * KSTEP))) ** 2
-                if sqe < bestsqe:
-                    bestkid, bestsqe = kidelay, sqe
-
-            # Take the Kaelus delay with the smallest sum-of-squares error and use that
-            if verbose:
-                print("BF %s: Naive KD=%d, tried range from %d - %d, settled on KD=%d" % (bfid, idelays['K'][bfid], begin, end, bestkid))
-            # delay2 = bestkid * KSTEP
-            idelays['K'][bfid] = bestkid
+    if offsets_arr is None:
+        offsets_arr = offsets_array(offsets)
 
-        # Copy the integer 1st stage delay values
-        idelays[bfid] = copy.copy(indelays[bfid])
+    # As in calc_delays(), the delays are calculated in numpy arrays indexed by [beamformer, dipole] (or just
+    # [beamformer] for the Kaelus delays), using integer indices, and only converted to nested dicts at the end.
 
-    # Calculate a final sum-of-squares error for the differences between ideal geometric and actual quantised, rounded delays, as a measure of pointing quality.
-    sqe = 0.0
-    maxerr = 0.0
-    offcount = 0
-    for bfid in HEXD:
-        for dipid in HEXD:
-            err = (delays[bfid][dipid] - ((idelays[bfid][dipid] * MSTEP) + (idelays['K'][bfid] * KSTEP)))
-            delayerrs[bfid][dipid] = err
-            if abs(err) > maxerr:  # Update the largest error value found in this pointing calculation so far
-                maxerr = abs(err)
-            if abs(
-                    err) > errorlimit:  # If any dipole has an error greater than the maximum allowed error, then either disable it, or just fail
-                if strict:
-                    if verbose:
-                        print("BF %s: Dipole %s exceeds maximum error limit: %5.0f > %5.0f" % (bfid, dipid, maxerr, errorlimit))
-                    return None, None
-                if clipdelays:  # Don't disable the dipole if we want to use single-beamformer mode, for example, after normalising delays
-                    idelays[bfid][
-                        dipid] = 16  # This disables the dipole, because 16 is added before sending it to the BF hardware
-                offcount += 1  # Add to the count of disabled dipoles
-            sqe += err * err
+    # Calculate all 256 geometric delays in picoseconds as signed floats, relative to the station centre. 'delays_arr'
+    # contains 256 _total_ delays in picoseconds, one for each dipole, not split into first/second stages
+    delays_arr = calc_geometric_delays(offsets_arr, az=az, el=el, cpos=cpos, bfcorrs=False)
 
-    return idelays, (delays, delayerrs, sqe, maxerr, offcount)
+    # The integer 1st stage delay values we've been given, which we keep
+    idelays_arr = numpy.array([[indelays[bfid][dipid] for dipid in HEXD] for bfid in HEXD], dtype=numpy.int32)
+    # The part of each dipole's delay that's left for the Kaelus delay
+    resids_arr = delays_arr - (idelays_arr * MSTEP)
+
+    # The Kaelus delay for each 1st-stage BF - the difference between the mean geometric delay and the mean input 1st
+    # stage delay, for the 16 dipoles on that BF, rounded to the nearest Kaelus delay step. If it's outside the range of
+    # possible Kaelus delay values, make it as large/small as possible.
+    kmin, kmax = MINV2 + HEADROOM, MAXV2 - HEADROOM
+    kdelays = numpy.clip(numpy.rint(resids_arr.mean(axis=1) * INV_KSTEP), kmin, kmax).astype(numpy.int32)
+
+    # With the 1st stage delays fixed, the sum-of-squares error is a quadratic in the Kaelus delay, with its minimum at
+    # the mean residual delay - so the value above is already the best one, and unlike calc_delays(), there's no need
+    # to search the +/-6 step window around it when optimising.
+    if optimise and verbose:
+        print("\n".join(["BF %s: Naive KD=%d, tried range from %d - %d, settled on KD=%d" % (bfid, kdelay, max(kmin, kdelay - KSEARCH),
+                                                                                           min(kmax, kdelay + KSEARCH), kdelay)
+                         for bfid, kdelay in zip(HEXD, kdelays.tolist())]))
+
+    # Calculate the final errors, and disable (or fail on) any dipoles outside the error limit
+    return _finish_delays(delays_arr, kdelays, idelays_arr=idelays_arr,
+                          verbose=verbose, errorlimit=errorlimit, strict=strict, clipdelays=clipdelays)
 
 
 def pdelays(delays=None, errors=None):
     """Pretty-print the given delays and calculate and print some statistics about the delay values.
+
+       The output is built up as a list of lines, and printed all at once at the end.
     """
     fstring = "%3d  " * 16
-    print("Integer delays for each dipole, and Kaelus BF:")
-    print("Dipole:                 0    1    2    3    4    5    6    7    8    9    A    B    C    D    E    F")
+    lines = ["Integer delays for each dipole, and Kaelus BF:",
+             "Dipole:                 0    1    2    3    4    5    6    7    8    9    A    B    C    D    E    F"]
     for bfid in HEXD:
-        mindelay = min(delays[bfid].values())
-        maxdelay = max(delays[bfid].values())
-        meandelay = sum(delays[bfid].values()) / 16.0
-        print("BF %s: delay = (%3d) +" % (bfid, delays['K'][bfid]),
-              fstring % tuple([delays[bfid][dipid] for dipid in HEXD]),
-              "   Max=%3d, Min=%3d, Mean=%7.3f" % (maxdelay, mindelay, meandelay))
-
-    print()
-    mindelay = min(delays['K'].values())
-    maxdelay = max(delays['K'].values())
-    meandelay = sum(delays['K'].values()) / 16.0
-    print("KB:   Max=%3d, Min=%3d, Mean=%7.3f" % (maxdelay, mindelay, meandelay))
+        bfdelays = [delays[bfid][dipid] for dipid in HEXD]
+        lines.append("BF %s: delay = (%3d) + %s    Max=%3d, Min=%3d, Mean=%7.3f" % (bfid, delays['K'][bfid],
+                                                                              fstring % tuple(bfdelays),
+                                                                              max(bfdelays), min(bfdelays),
+                                                                              sum(bfdelays) / 16.0))
+
+    lines.append("")
+    kdelays = list(delays['K'].values())
+    lines.append("KB:   Max=%3d, Min=%3d, Mean=%7.3f" % (max(kdelays), min(kdelays), sum(kdelays) / 16.0))
 
     if errors is not None:
         rdelays, delayerrs, errsum, maxerr, offcount = errors
-        print()
-        print("%d dipoles disabled because delays exceeded limits" % offcount)
-        print("Delay errors per dipole, in cm:")
+        lines.append("")
+        lines.append("%d dipoles disabled because delays exceeded limits" % offcount)
+        lines.append("Delay errors per dipole, in cm:")
         fstring = "%3.0f  " * 16
-        print("Dipole:                 0    1    2    3    4    5    6    7    8    9    A    B    C    D    E    F")
+        lines.append("Dipole:                 0    1    2    3    4    5    6    7    8    9    A    B    C    D    E    F")
         for bfid in HEXD:
-            minerr = min(delayerrs[bfid].values()) * 100 * C
-            maxerr = max(delayerrs[bfid].values()) * 100 * C
-            print("BF %s:                " % bfid,
-                  fstring % tuple([delayerrs[bfid][dipid] * 100 * C for dipid in HEXD]),
-                  "   Max=%3d, Min=%3d" % (maxerr, minerr))
+            bferrs = [delayerrs[bfid][dipid] * 100 * C for dipid in HEXD]
+            lines.append("BF %s:                 %s    Max=%3d, Min=%3d" % (bfid, fstring % tuple(bferrs),
+                                                                        max(bferrs), min(bferrs)))
+    print("\n".join(lines))
 
 
-def track(offsets=None, fname='', errorlimit=MAXERRORSTRICT):
+def _track_worker(args):
+    """Run calc_delays_batch() on one block of a track, in a worker process started by track().
+    """
+    offsets, az, el, errorlimit = args
+    return calc_delays_batch(offsets=offsets, az=az, el=el, errorlimit=errorlimit)
+
+
+def track(offsets=None, fname='', errorlimit=MAXERRORSTRICT, processes=None):
     """Given a file containing lines with three values (gpsseconds, az, el), read in the contents
        line by line and print status and flags when the source becomes visible to this station
        (using the provided dipole offsets in 'offsets'), when it is no longer visible, and when the
        MWA and Kaelus dipoles change state.
+
+       The delays for each block of TRACK_BLOCK lines are calculated in parallel, in a pool of 'processes'
+       worker processes (default is one per CPU). Use processes=1 to do everything in this process.
     """
-    f = open(fname, 'rt')
+    offsets = offsets_array(offsets)  # Convert the offsets once, not twice for every line
+    with open(fname, 'rt') as f:
+        rows = [tuple(map(float, line.split())) for line in f]
     odelays = None
     fixdelays = None
-    lines = f.readlines()
-    for line in lines:
-        t, az, el = tuple(map(float, line.split()))
-        newdelays, newerrors = calc_delays(offsets=offsets, az=az, el=el, verbose=False, errorlimit=errorlimit)
+    # Calculate the delays for the whole track at once, then look for the state changes
+    azs = [row[1] for row in rows]
+    els = [row[2] for row in rows]
+    if processes == 1 or len(rows) <= TRACK_BLOCK:
+        pointings = calc_delays_batch(offsets=offsets, az=azs, el=els, errorlimit=errorlimit)
+    else:
+        blocks = [(offsets, azs[i:i + TRACK_BLOCK], els[i:i + TRACK_BLOCK], errorlimit)
+                  for i in range(0, len(rows), TRACK_BLOCK)]
+        with multiprocessing.Pool(processes) as pool:
+            pointings = [pointing for block in pool.map(_track_worker, blocks) for pointing in block]
+    for (t, az, el), (newdelays, newerrors) in zip(rows, pointings):
         if newdelays is None:
             print("Oops.", (odelays is None))
         if (odelays is None) and (newdelays is not None):
@@ -550,35 +628,35 @@ def track(offsets=None, fname='', errorlimit=MAXERRORSTRICT):
 
 
 def plotErrors(offsets=None, npts=100):
-    import numpy
-    import random
-    from matplotlib.mlab import griddata
+    import matplotlib.tri as mtri  # Only imported here, so calc_delays() users never pay for loading matplotlib
     import matplotlib.pyplot as plt
-    import numpy as np
 
-    x = numpy.zeros(shape=npts)
-    y = numpy.zeros(shape=npts)
-    z1 = numpy.zeros(shape=npts)
-    z2 = numpy.zeros(shape=npts)
+    # Azimuth, elevation, RMS error and max error for each sample point, as the four rows of one contiguous array
+    x, y, z1, z2 = numpy.empty((4, npts))
+    rng = numpy.random.default_rng()
     i = 0
     while i < npts:
-        x[i] = random.uniform(0, 360)
-        y[i] = random.uniform(70, 90)
-        delays, errors = calc_delays(offsets=offsets, az=x[i], el=y[i], verbose=False, strict=True)
-        if errors is not None:
-            delays, delayerrs, errsum, maxerr = errors
-            z1[i] = math.sqrt(errsum / 256)
-            z2[i] = maxerr
-            i += 1
+        # Calculate all the random points we still need at once, and keep the ones that can be pointed at
+        naz = rng.uniform(0.0, 360.0, size=npts - i)
+        nel = rng.uniform(70.0, 90.0, size=npts - i)
+        errors = [errs for idelays, errs in calc_delays_batch(offsets=offsets, az=naz, el=nel, strict=True)]
+        good = numpy.array([errs is not None for errs in errors], dtype=bool)
+        n = int(good.sum())
+        x[i:i + n] = naz[good]
+        y[i:i + n] = nel[good]
+        z1[i:i + n] = numpy.sqrt(numpy.array([errs[2] for errs in errors if errs is not None]) / 256)
+        z2[i:i + n] = [errs[3] for errs in errors if errs is not None]
+        i += n
     # define grid.
-    xi = np.linspace(0, 360, 1800)
-    yi = np.linspace(70, 90, 100)
-    # grid the data.
-    z1i = griddata(x, y, z1, xi, yi, interp='linear')
-    z2i = griddata(x, y, z2, xi, yi, interp='linear')
-
-    plt.figure(figsize=(24, 12), dpi=300)
-    f, axarr = plt.subplots(nrows=2, ncols=1, sharex=True, sharey=False, squeeze=True)
+    xi = numpy.linspace(0, 360, 1800)
+    yi = numpy.linspace(70, 90, 100)
+    # grid the data, using one triangulation of the sample points for both the RMS and max error values
+    tri = mtri.Triangulation(x, y)
+    xg, yg = numpy.meshgrid(xi, yi)
+    z1i = mtri.LinearTriInterpolator(tri, z1)(xg, yg)
+    z2i = mtri.LinearTriInterpolator(tri, z2)(xg, yg)
+
+    f, axarr = plt.subplots(nrows=2, ncols=1, sharex=True, sharey=False, squeeze=True, figsize=(24, 12), dpi=300)
     #  plt.subplots_adjust(left=0.125, bottom=0.1, right=0.9, top=0.9,
     #                wspace=0.0, hspace=0.1)
 
@@ -587,9 +665,10 @@ def plotErrors(offsets=None, npts=100):
 
     # contour the gridded RMS error data, plotting dots at the nonuniform data points.
     rmserror = z1i * C * 100.0
-    ECS1 = rmsf.contour(xi, yi, rmserror, 8, linewidths=0.5, colors='k')
-    ECS2 = rmsf.contourf(xi, yi, rmserror, 8, cmap=plt.cm.rainbow,
-                         vmax=abs(rmserror).max(), vmin=-abs(rmserror).max())
+    levels = numpy.linspace(rmserror.min(), rmserror.max(), 9)  # The same 8 intervals for the lines and the fill
+    rmsmax = abs(rmserror).max()
+    ECS1 = rmsf.contour(xi, yi, rmserror, levels=levels, linewidths=0.5, colors='k')
+    ECS2 = rmsf.contourf(xi, yi, rmserror, levels=levels, cmap=plt.cm.rainbow, vmax=rmsmax, vmin=-rmsmax)
     plt.colorbar(mappable=ECS2, ax=rmsf)  # draw colorbar
     # plot data points.
     rmsf.scatter(x, y, marker='.', c='b', s=0.1, zorder=10)
@@ -599,9 +678,10 @@ def plotErrors(offsets=None, npts=100):
 
     # contour the gridded maximum error data, plotting dots at the nonuniform data points.
     maxerror = z2i * C * 100
-    MCS1 = maxf.contour(xi, yi, maxerror, 8, linewidths=0.5, colors='k')
-    MCS2 = maxf.contourf(xi, yi, maxerror, 8, cmap=plt.cm.rainbow,
-                         vmax=abs(maxerror).max(), vmin=-abs(maxerror).max())
+    levels = numpy.linspace(maxerror.min(), maxerror.max(), 9)
+    maxmax = abs(maxerror).max()
+    MCS1 = maxf.contour(xi, yi, maxerror, levels=levels, linewidths=0.5, colors='k')
+    MCS2 = maxf.contourf(xi, yi, maxerror, levels=levels, cmap=plt.cm.rainbow, vmax=maxmax, vmin=-maxmax)
     plt.colorbar(mappable=MCS2, ax=maxf)  # draw colorbar
     # plot data points.
     maxf.scatter(x, y, marker='.', c='b', s=0.1, zorder=10)
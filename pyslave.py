@@ -1,4 +1,5 @@
 import logging
+import os
 import socket
 import threading
 import time
@@ -7,6 +8,17 @@ import traceback
 import Pyro4
 import Pyro4.socketutil
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if msgpack is not None:
+    # Let callers send notify() and other calls to any slave using msgpack, which is much faster than serpent to
+    # encode and decode the nested 'values' dicts. Pyro4 replies using whatever serializer the caller used, so the
+    # controller only needs to set its proxy's serializer to 'msgpack' to use it. Note that msgpack turns tuples into lists.
+    Pyro4.config.SERIALIZERS_ACCEPTED.add('msgpack')
+
 loglevel = logging.DEBUG
 
 # set up the logging
@@ -14,6 +26,11 @@ logger = logging.getLogger()
 logger.setLevel(loglevel)
 
 REFERENCEIP = '8.8.8.8'  # A host guaranteed to be visible on the network interface that we want the Pyro server to bind to
+BIND_IP = os.environ.get('PYRO_BIND_IP')  # If set, bind the Pyro server to this address instead of looking it up using REFERENCEIP
+
+# Seconds between the Unix epoch (1970-01-01) and the GPS epoch (1980-01-06), less the leap seconds since then. Only
+# approximate, because it doesn't change when new leap seconds are added - subtract it from a Unix time to get GPS seconds.
+GPS_UNIX_OFFSET = 315964783
 
 
 class Slave(object):
@@ -35,7 +52,9 @@ class Slave(object):
             self.uri = None
             self.port = None
         self.pyro_daemon = None
+        self.iface = BIND_IP  # Network IP address to bind the Pyro daemon to, found when the server first starts if not set
         self.exiting = False
+        self.exit_event = threading.Event()  # Set by stop(), to wake up anything waiting in notify()
         self.rclass = rclass
         self.sthread = None
         self.clientid = clientid
@@ -75,6 +94,14 @@ class Slave(object):
         self.sthread.start()
         self.started = True
 
+    def stop(self):
+        """Shut down the Pyro4 request loop, and wake up any notify() call that's still waiting for its start time.
+        """
+        self.exiting = True
+        self.exit_event.set()
+        if self.pyro_daemon is not None:
+            self.pyro_daemon.shutdown()
+
     @Pyro4.expose
     def notify(self, obsid=None, starttime=None, stoptime=None, clientid=None, rclass=None, values=None):
         """Called remotely by the master object when registered tile properties change.
@@ -97,49 +124,86 @@ class Slave(object):
            :return:          A tuple of (clientid, obsid, starttime, result) where 'result' depends on the registration
                               class ('pointing', etc)., and the other items are defined above.
         """
-        logger.info("Notify called on slave at %s" % self.uri)
-        logger.info("obsid=%s, starttime=%s, clientid=%s, rclass=%s, values=%s" % (obsid, starttime, clientid, rclass, values))
-        if starttime != obsid:  # It's a unix time stamp, not gpstime
-            now = time.time()
-        else:
-            now = time.time() - 315964783  # Hack conversion to gpsseconds - this method will be overridden anyway
+        logger.info("Notify called on slave at %s", self.uri)
+        logger.info("obsid=%s, starttime=%s, clientid=%s, rclass=%s, values=%s", obsid, starttime, clientid, rclass, values)
+        now = time.time()
+        if starttime == obsid:  # It's gpstime, not a unix time stamp
+            now -= GPS_UNIX_OFFSET  # Hack conversion to gpsseconds - this method will be overridden anyway
         if starttime > now:
-            logger.debug('Sleeping for %d seconds' % (starttime - now))
-            time.sleep(starttime - now)
+            logger.debug('Sleeping for %d seconds', starttime - now)
+            if self.exit_event.wait(starttime - now):
+                logger.info("Slave is exiting, notify abandoned.")
+                return self.clientid, obsid, starttime, False
         else:
-            logger.critical('ERROR! Notification arrived after nominal start time: %s > %s' % (now, starttime))
+            logger.critical('ERROR! Notification arrived after nominal start time: %s > %s', now, starttime)
         logger.info("Notify finished.")
         return self.clientid, obsid, starttime, True
 
-    def _ServePyroRequests(self):
-        """When called, start serving Pyro requests. Method will not ever exit.
+    @Pyro4.expose
+    def notify_batch(self, batch=None):
+        """Called remotely by the master object to send several notifications in one network round trip.
+
+           Each notification is handled by calling notify(), in order of start time, so a subclass only has to
+           override notify().
+
+           :param batch: A list of dicts, each containing the keyword arguments for one notify() call.
+           :return: A list of the results returned by notify(), in the same order as the notifications in 'batch'.
+        """
+        results = [None] * len(batch)
+        for i in sorted(range(len(batch)), key=lambda j: batch[j].get('starttime') or 0):
+            results[i] = self.notify(**batch[i])
+        return results
+
+    def _tune_sockets(self):
+        """Set low-latency options on the Pyro daemon's listening socket/s. Sockets for incoming connections inherit
+           these options, so small replies aren't held back by Nagle's algorithm, and dead client connections are
+           eventually noticed by the kernel.
         """
-        iface = None
-        logger.info('Getting interface address for pycontroller Pyro server')
-        while (iface is None) and not self.exiting:
+        for sock in self.pyro_daemon.sockets:
             try:
-                iface = Pyro4.socketutil.getInterfaceAddress(REFERENCEIP)  # What is the network IP of this receiver?
-            except socket.error:
-                logger.info("Network down, can't start pycontroller slave Pyro server, sleeping for 10 seconds")
-                if not self.exiting:
-                    time.sleep(10)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            except (socket.error, AttributeError):
+                logger.warning("Can't set socket options on Pyro4 daemon socket %s", sock)
 
+    def _ServePyroRequests(self):
+        """When called, start serving Pyro requests. Method will not ever exit.
+        """
         while not self.exiting:
+            if self.iface is None:  # Only look up the interface address the first time, or if binding to it failed
+                logger.info('Getting interface address for pycontroller Pyro server')
+                try:
+                    self.iface = Pyro4.socketutil.getInterfaceAddress(REFERENCEIP)  # What is the network IP of this receiver?
+                except socket.error:
+                    logger.info("Network down, can't start pycontroller slave Pyro server, sleeping for 10 seconds")
+                    if not self.exiting:
+                        time.sleep(10)
+                    continue
+
             logger.info("Starting pycontroller slave Pyro4 server")
             try:
                 if (self.uri is None) or (self.port is None):
                     # just start a new daemon on a random port
-                    self.pyro_daemon = Pyro4.Daemon(host=iface)
+                    self.pyro_daemon = Pyro4.Daemon(host=self.iface)
                     self.port = int(self.pyro_daemon.locationStr.split(':')[1])
                     # register the object in the daemon
                     self.uri = str(self.pyro_daemon.register(self, objectId=self.clientid))
                 else:
                     # Use the same port number, so we guarantee the URI stays the same
-                    self.pyro_daemon = Pyro4.Daemon(host=iface, port=self.port)
+                    self.pyro_daemon = Pyro4.Daemon(host=self.iface, port=self.port)
                     # register the object in the daemon
                     self.uri = self.pyro_daemon.register(self, objectId=self.clientid)
-                logger.info('pycontroller slave daemon registered as %s' % self.uri)
-            except:
+                self._tune_sockets()
+                logger.info('pycontroller slave daemon registered as %s', self.uri)
+            except socket.error:
+                self.iface = BIND_IP  # The address may have changed, so look it up again before retrying, unless it's fixed
+                if not self.exiting:
+                    logger.error("Network error in pycontroller slave Pyro4 startup. Retrying in 10 sec: %s" % (traceback.format_exc(),))
+                    time.sleep(10)
+                else:
+                    logger.info("Pyro4 slave server is exiting.")
+                continue
+            except Exception:
                 if not self.exiting:
                     logger.error("Exception in pycontroller slave Pyro4 startup. Retrying in 10 sec: %s" % (traceback.format_exc(),))
                     time.sleep(10)
@@ -150,7 +214,7 @@ class Slave(object):
             try:
                 self.running = True
                 self.pyro_daemon.requestLoop()
-            except:
+            except Exception:
                 self.running = False
                 if not self.exiting:
                     logger.error("Exception in pycontroller slave Pyro4 server. Restarting in 10 sec: %s" % (traceback.format_exc(),))
@@ -160,4 +224,6 @@ class Slave(object):
 
 
 def clientidbit(uri=''):
-    return str(uri).split(':')[1].split('@')[0]
+    """Return the object name from a Pyro URI, eg 'Kaelus' from 'PYRO:Kaelus@10.128.2.51:19987'.
+    """
+    return str(uri).partition(':')[2].partition(':')[0].partition('@')[0]
@@ -14,11 +14,13 @@
        and it also depends on the EDA pointing library (pointing.py).
 """
 
+import functools
 import pickle
 import math
 import optparse
 import sys
 
+import numpy
 import vpython
 from vpython import color
 from vpython import vector as v
@@ -30,62 +32,87 @@ STRICT = False
 CPOS = (0.0, 0.0, 0.0)
 
 EDAOFFSETS = pointing.getOffsets()
+EDAOFFSETS_ARR = pointing.offsets_array(EDAOFFSETS)  # (16, 16, 3) dipole positions, indexed by [beamformer, dipole]
 
 TILEDIPSEP = 1.10  # dipole separations in meters for an MWA tile
 TILEOFFSETS = [(-1.5, 1.5), (-0.5, 1.5), (0.5, 1.5), (1.5, 1.5),
                (-1.5, 0.5), (-0.5, 0.5), (0.5, 0.5), (1.5, 0.5),
                (-1.5, -0.5), (-0.5, -0.5), (0.5, -0.5), (1.5, -0.5),
                (-1.5, -1.5), (-0.5, -1.5), (0.5, -1.5), (1.5, -1.5)]
+TILE_XY = numpy.array(TILEOFFSETS, dtype=numpy.float64) * TILEDIPSEP  # (x, y) dipole positions in metres, one row per dipole
 TILEDELAYSTEP = 435  # MWA beamformer delay step, in picoseconds
+OFFSET_TIE_TOLERANCE = 1e-3  # Mean squared delay deviations closer than this (in ps^2) are a tie in best_offset()
 
-g = open('gridpoints3.pickle', 'rb')
-GRID_POINTS = pickle.load(g, encoding='bytes')
-g.close()
+DTOR = math.pi / 180.0  # convert degrees to radians
 
+DIPHEIGHT = 0.4  # Top of dipole batwing corner to ground, in metres
+DIPSTANDOFF = 0.1  # Ground to bottom of dipole batwing triangle, in metres
+LNALEN = 0.15  # Length of the LNA cylinder on top of each dipole, in metres
+DIPOLE_PROTO = None  # A vpython compound object for a single dipole, cloned by getdipole() - see _build_dipole_proto()
 
-def getdipole(cpos=None, dlabel=None):
-    """Creates and returns a list of 3D objects making up a single MWA dipole. If cpos
-       is given, it must be a vpython.vector object used for the center of the dipole (actually
-       the point on the ground directly underneath the LNA tube). If dlabel is given, it must
-       be a one or two letter label to draw on the top of the LNA tube."""
+ARROW_POOLS = {}  # Lists of vpython arrow objects, re-used every time the delays are redrawn - see place_arrows()
+
+GRID_POINTS = None  # Loaded from gridpoints3.pickle by load_grid() the first time get_sweet_delays() is called
+GRID_XYZ = None
+GRID_SIGMA = None
+
+
+def _build_dipole_proto():
+    """Creates and returns a single, invisible vpython compound object made up of all the parts of one MWA dipole,
+       centred on the origin. getdipole() clones this for each dipole, which is much faster than creating all the
+       separate boxes and cylinders again for every dipole, and the browser draws each clone in one go.
+    """
     width = 0.35  # Center to edge of batwing
-    height = 0.4  # Top of batwing corner to ground
-    standoff = 0.1  # ground to bottom of batwing triangle
-    cylen = 0.15  # length of LNA cylinder
+    height = DIPHEIGHT  # Top of batwing corner to ground
+    standoff = DIPSTANDOFF  # ground to bottom of batwing triangle
+    cylen = LNALEN  # length of LNA cylinder
     cydia = 0.15  # diameter of LNA cylinder
     cpoint = v(0, 0, (height / 2.0 + standoff))
     boxw = 0.02  # thickness of dipole arms
     tubeoff = standoff  # gap between bottom of wire tube and the ground
-    if cpos is None:
-        cpos = v(0, 0, 0)
-    elif type(cpos) == tuple:
-        cpos = v(cpos)
 
-    xl = vpython.box(pos=v(-width, 0, (height + standoff) / 2) + cpos, axis=v(0, 0, 1), height=boxw, width=boxw,
+    xl = vpython.box(pos=v(-width, 0, (height + standoff) / 2), axis=v(0, 0, 1), height=boxw, width=boxw,
                      length=height + boxw, color=vpython.color.gray(0.8))
-    xlt = vpython.box(pos=v(0, 0, cpoint.z) + cpos, axis=(v(width, 0, standoff) - v(-width, 0, height)), height=boxw,
+    xlt = vpython.box(pos=v(0, 0, cpoint.z), axis=(v(width, 0, standoff) - v(-width, 0, height)), height=boxw,
                       width=boxw, color=vpython.color.gray(0.8))
-    xlb = vpython.box(pos=v(0, 0, cpoint.z) + cpos, axis=(v(width, 0, height) - v(-width, 0, standoff)), height=boxw,
+    xlb = vpython.box(pos=v(0, 0, cpoint.z), axis=(v(width, 0, height) - v(-width, 0, standoff)), height=boxw,
                       width=boxw, color=vpython.color.gray(0.8))
-    xr = vpython.box(pos=v(width, 0, (height + standoff) / 2) + cpos, axis=v(0, 0, 1), height=boxw, width=boxw,
+    xr = vpython.box(pos=v(width, 0, (height + standoff) / 2), axis=v(0, 0, 1), height=boxw, width=boxw,
                      length=height + boxw, color=vpython.color.gray(0.8))
 
-    yl = vpython.box(pos=v(0, -width, (height + standoff) / 2) + cpos, axis=v(0, 0, 1), height=boxw, width=boxw,
+    yl = vpython.box(pos=v(0, -width, (height + standoff) / 2), axis=v(0, 0, 1), height=boxw, width=boxw,
                      length=height + boxw, color=vpython.color.gray(0.8))
-    ylt = vpython.box(pos=v(0, 0, cpoint.z) + cpos, axis=(v(0, width, standoff) - v(0, -width, height)), height=boxw,
+    ylt = vpython.box(pos=v(0, 0, cpoint.z), axis=(v(0, width, standoff) - v(0, -width, height)), height=boxw,
                       width=boxw, color=vpython.color.gray(0.8))
-    ylb = vpython.box(pos=v(0, 0, cpoint.z) + cpos, axis=(v(0, width, height) - v(0, -width, standoff)), height=boxw,
+    ylb = vpython.box(pos=v(0, 0, cpoint.z), axis=(v(0, width, height) - v(0, -width, standoff)), height=boxw,
                       width=boxw, color=vpython.color.gray(0.8))
-    yr = vpython.box(pos=v(0, width, (height + standoff) / 2) + cpos, axis=v(0, 0, 1), height=boxw, width=boxw,
+    yr = vpython.box(pos=v(0, width, (height + standoff) / 2), axis=v(0, 0, 1), height=boxw, width=boxw,
                      length=height + boxw, color=vpython.color.gray(0.8))
 
-    lna = vpython.cylinder(pos=v(0, 0, cpoint.z - cylen / 2) + cpos, axis=v(0, 0, cylen), radius=cydia / 2.0,
+    lna = vpython.cylinder(pos=v(0, 0, cpoint.z - cylen / 2), axis=v(0, 0, cylen), radius=cydia / 2.0,
                            color=color.white)
-    tube = vpython.cylinder(pos=v(0, 0, tubeoff) + cpos, radius=boxw / 2.0, axis=v(0, 0, cpoint.z - standoff),
+    tube = vpython.cylinder(pos=v(0, 0, tubeoff), radius=boxw / 2.0, axis=v(0, 0, cpoint.z - standoff),
                             color=color.white)
-    olist = [xl, xlt, xlb, xr, yl, ylt, ylb, yr, lna, tube]
+    proto = vpython.compound([xl, xlt, xlb, xr, yl, ylt, ylb, yr, lna, tube], origin=v(0, 0, 0))
+    proto.visible = False
+    return proto
+
+
+def getdipole(cpos=None, dlabel=None):
+    """Creates and returns a list of 3D objects making up a single MWA dipole. If cpos
+       is given, it must be a vpython.vector object used for the center of the dipole (actually
+       the point on the ground directly underneath the LNA tube). If dlabel is given, it must
+       be a one or two letter label to draw on the top of the LNA tube."""
+    global DIPOLE_PROTO
+    if cpos is None:
+        cpos = v(0, 0, 0)
+
+    if DIPOLE_PROTO is None:  # Built on first use, not at import time, because it needs a vpython canvas
+        DIPOLE_PROTO = _build_dipole_proto()
+    olist = [DIPOLE_PROTO.clone(pos=cpos, visible=True)]
     if dlabel and showlabels:
-        lnalabel = vpython.text(text=dlabel, pos=lna.pos + lna.axis + v(-0.035 * len(dlabel), -0.035, 0), height=0.07,
+        lnatop = DIPHEIGHT / 2.0 + DIPSTANDOFF + LNALEN / 2.0  # Height of the top of the LNA cylinder
+        lnalabel = vpython.text(text=dlabel, pos=cpos + v(-0.035 * len(dlabel), -0.035, lnatop), height=0.07,
                                 depth=0.01, color=color.black)
         olist.append(lnalabel)
     return olist
@@ -120,8 +147,8 @@ def gettile(offsets=None, cpos=None):
 
     if cpos is None:
         cpos = v(0, 0, 0)
-    elif type(cpos) == tuple:
-        cpos = v(cpos)
+    elif isinstance(cpos, tuple):
+        cpos = v(*cpos)
 
     eaxis = vpython.arrow(pos=v(0, 0, 0), axis=v(3, 0, 0), color=color.blue, shaftwidth=0.1, fixedwidth=True,
                           opacity=0.2)
@@ -141,6 +168,51 @@ def gettile(offsets=None, cpos=None):
     return olist
 
 
+def place_arrows(name, placements, axis, visible, **style):
+    """Point a set of delay arrows, re-using the vpython arrow objects from the last time this set was drawn, and
+       only creating new ones if there are more arrows in this set than last time. Any left-over arrows from the
+       pool are hidden. Every new arrow object has to be sent to the browser, so this is much faster than
+       creating all the arrows again every time the pointing changes.
+
+       :param name: Name of the set of arrows, eg 'ideal' - each set has its own pool, in ARROW_POOLS
+       :param placements: A list of (pos, length) tuples, one for each arrow
+       :param axis: A vpython vector, the direction for all of the arrows
+       :param visible: True if the arrows should be shown
+       :param style: Extra keyword arguments (color, shaftwidth, etc) passed when creating new arrows for this pool
+       :return: A list of the arrow objects used
+    """
+    pool = ARROW_POOLS.setdefault(name, [])
+    while len(pool) < len(placements):
+        pool.append(vpython.arrow(visible=False, **style))
+    for ob, (pos, length) in zip(pool, placements):
+        ob.pos = pos
+        ob.axis = axis
+        ob.length = length
+        ob.visible = visible
+    for ob in pool[len(placements):]:
+        ob.visible = False
+    return pool[:len(placements)]
+
+
+def hide_arrows():
+    """Hide every arrow in every pool.
+    """
+    for pool in ARROW_POOLS.values():
+        for ob in pool:
+            ob.visible = False
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_eda_delays(az=0.0, el=90.0, cpos=(0.0, 0.0, 0.0), clipdelays=True, strict=False):
+    """Return pointing.calc_delays() for the EDA dipole layout in EDAOFFSETS, only calculating it the first time
+       we're asked for any given az, el and settings - the arrow keys step around a fixed grid of pointings.
+
+       The result is shared between calls, so the caller must copy it before modifying it.
+    """
+    return pointing.calc_delays(offsets=EDAOFFSETS, az=az, el=el, strict=strict, verbose=True,
+                                clipdelays=clipdelays, cpos=cpos)
+
+
 def getedadelays(offsets=EDAOFFSETS, az=0.0, el=90.0):
     """Create and return 3D objects representing the pointing delays for all 256 EDA dipoles.
        They are represented by arrows for each dipole, with a length equal to that dipoles delay value
@@ -160,8 +232,13 @@ def getedadelays(offsets=EDAOFFSETS, az=0.0, el=90.0):
         clipdelays = False
     else:
         clipdelays = True
-    idelays, diagnostics = pointing.calc_delays(offsets=offsets, az=az, el=el, strict=STRICT, verbose=True,
-                                                clipdelays=clipdelays, cpos=CPOS)
+    if offsets is EDAOFFSETS:
+        idelays, diagnostics = cached_eda_delays(az=az, el=el, cpos=CPOS, clipdelays=clipdelays, strict=STRICT)
+        if idelays is not None:
+            idelays = dict((bfid, dict(bfdelays)) for bfid, bfdelays in idelays.items())  # We modify it below
+    else:
+        idelays, diagnostics = pointing.calc_delays(offsets=offsets, az=az, el=el, strict=STRICT, verbose=True,
+                                                    clipdelays=clipdelays, cpos=CPOS)
     if diagnostics is not None:
         delays, delayerrs, sqe, maxerr, offcount = diagnostics
         if offcount > 0:
@@ -209,44 +286,71 @@ def getedadelays(offsets=EDAOFFSETS, az=0.0, el=90.0):
                     offcount += 1
 
     north = v(0, 1, 0)  # Due north, elevation 0 degrees
-    t1 = vpython.rotate(north, angle=(el * math.pi / 180.0),
+    t1 = vpython.rotate(north, angle=(el * DTOR),
                         axis=v(1, 0, 0))  # Rotate up (around E/W axis) by 'el' degrees
-    pvector = vpython.rotate(t1, angle=(-az * math.pi / 180.0),
+    pvector = vpython.rotate(t1, angle=(-az * DTOR),
                              axis=v(0, 0, 1))  # Rotate clockwise by 'az' degrees around 'up' axis
-    parrow = vpython.arrow(pos=v(0, 0, 0), axis=pvector, color=color.yellow, length=20.0, shaftwidth=1.0, visible=True)
-
-    ilist = []
-    alist = []
-    dlist = []
-    for bfid in pointing.HEXD:
-        for dipid in pointing.HEXD:
-            # Arrow lengths are negative if delays are positive, and vice/versa
-            if delays:
-                idealdelay = delays[bfid][dipid] * pointing.C
-                ilist.append(vpython.arrow(pos=v(*offsets[bfid][dipid]),
-                                           axis=pvector,
-                                           length=-idealdelay,
-                                           color=color.white,
-                                           shaftwidth=0.2,
-                                           visible=ivis))
-                if idelays[bfid][dipid] != 16:  # If this dipole isn't disabled
-                    actualdelay = ((idelays[bfid][dipid] * pointing.MSTEP) + (idelays['K'][bfid] * pointing.KSTEP)) * pointing.C
-                    alist.append(vpython.arrow(pos=v(*offsets[bfid][dipid]),
-                                               axis=pvector,
-                                               length=-actualdelay,
-                                               color=color.green,
-                                               shaftwidth=0.2,
-                                               visible=avis))
-                    delaydifference = idealdelay - actualdelay
-                    dlist.append(vpython.arrow(pos=v(*offsets[bfid][dipid]),
-                                               axis=pvector,
-                                               length=100 * delaydifference,
-                                               color=color.red,
-                                               shaftwidth=0.2,
-                                               visible=dvis))
+    parrow = place_arrows('edapointing', [(v(0, 0, 0), 20.0)], pvector, True, color=color.yellow, shaftwidth=1.0)[0]
+
+    ideal = []
+    actual = []
+    diffs = []
+    if delays and (ivis or avis or dvis):
+        # Do all the arithmetic on (16, 16) arrays indexed by [beamformer, dipole], so the loop below only has to
+        # place the arrows.
+        if offsets is EDAOFFSETS:
+            offsets_arr = EDAOFFSETS_ARR
+        else:
+            offsets_arr = pointing.offsets_array(offsets)
+        delays_arr = numpy.array([[delays[bfid][dipid] for dipid in pointing.HEXD] for bfid in pointing.HEXD])
+        idelays_arr = numpy.array([[idelays[bfid][dipid] for dipid in pointing.HEXD] for bfid in pointing.HEXD])
+        kdelays = numpy.array([idelays['K'][bfid] for bfid in pointing.HEXD])
+        idealdelays = delays_arr * pointing.C
+        actualdelays = ((idelays_arr * pointing.MSTEP) + (kdelays[:, numpy.newaxis] * pointing.KSTEP)) * pointing.C
+        enabled = idelays_arr != 16  # Dipoles that aren't disabled
+
+        # Arrow lengths are negative if delays are positive, and vice/versa. Sets of arrows that aren't visible
+        # are left empty - processClick() redraws the arrows when one of them is turned on.
+        dposlist = [v(*pos) for pos in offsets_arr.reshape(256, 3).tolist()]
+        for dpos, idealdelay, actualdelay, dipon in zip(dposlist,
+                                                        idealdelays.ravel().tolist(),
+                                                        actualdelays.ravel().tolist(),
+                                                        enabled.ravel().tolist()):
+            if ivis:
+                ideal.append((dpos, -idealdelay))
+            if dipon:
+                if avis:
+                    actual.append((dpos, -actualdelay))
+                if dvis:
+                    diffs.append((dpos, 100 * (idealdelay - actualdelay)))
+    ilist = place_arrows('ideal', ideal, pvector, ivis, color=color.white, shaftwidth=0.2)
+    alist = place_arrows('actual', actual, pvector, avis, color=color.green, shaftwidth=0.2)
+    dlist = place_arrows('diff', diffs, pvector, dvis, color=color.red, shaftwidth=0.2)
     return parrow, ilist, alist, dlist
 
 
+def load_grid():
+    """Load the MWA sweet-spot grid pointings from gridpoints3.pickle into GRID_POINTS, if that hasn't already been
+       done. Only tile mode uses them, so they aren't loaded at import time.
+
+       Also calculates GRID_XYZ, the unit vectors towards each of the grid pointings, one row of (x, y, z) each,
+       and GRID_SIGMA, their sigma values, so that get_sweet_delays() can find the closest one with a single
+       matrix multiply.
+    """
+    global GRID_POINTS, GRID_XYZ, GRID_SIGMA
+    if GRID_POINTS is not None:
+        return
+    g = open('gridpoints3.pickle', 'rb')
+    points = pickle.load(g, encoding='bytes')
+    g.close()
+    gaz = numpy.radians([gp[1] for gp in points])
+    gel = numpy.radians([gp[2] for gp in points])
+    GRID_XYZ = numpy.stack([numpy.cos(gaz) * numpy.cos(gel), numpy.sin(gaz) * numpy.cos(gel), numpy.sin(gel)], axis=-1)
+    GRID_SIGMA = numpy.array([gp[3] for gp in points], dtype=numpy.float64)
+    GRID_POINTS = points
+
+
+@functools.lru_cache(maxsize=4096)
 def get_sweet_delays(az=0.0, el=0.0, maxsigma=None):
     """
     (Written by David Kaplan, copied with minor changes from single_observation.py)
@@ -259,39 +363,52 @@ def get_sweet_delays(az=0.0, el=0.0, maxsigma=None):
     :param el: target El (deg)
     :param maxsigma: maximum sigma or None
     :return: azimuth, elevation, delays
+
+    Results are cached, so the returned delays list must not be modified.
     """
 
-    closest = None
-    # in degrees
-    closest_distance = 180
-    for g in GRID_POINTS:
-        number, azimuth, elevation, sigma, delays = g
-        if (maxsigma is None or sigma <= maxsigma):
-            x1 = math.cos(az * math.pi / 180.0) * math.cos(el * math.pi / 180.0)
-            y1 = math.sin(az * math.pi / 180.0) * math.cos(el * math.pi / 180.0)
-            z1 = math.sin(el * math.pi / 180.0)
-            x2 = math.cos(azimuth * math.pi / 180.0) * math.cos(elevation * math.pi / 180.0)
-            y2 = math.sin(azimuth * math.pi / 180.0) * math.cos(elevation * math.pi / 180.0)
-            z2 = math.sin(elevation * math.pi / 180.0)
-            arg = x1 * x2 + y1 * y2 + z1 * z2
-            if (arg > 1):
-                arg = 1
-            if (arg < -1):
-                arg = -1
-            theta = math.acos(arg) * 180.0 / math.pi
-            if (theta < closest_distance):
-                closest_distance = theta
-                closest = g
-    if (closest is None):
+    load_grid()
+    azr = math.radians(az)
+    elr = math.radians(el)
+    target = numpy.array([math.cos(azr) * math.cos(elr), math.sin(azr) * math.cos(elr), math.sin(elr)])
+    # The cosine of the angle between the target and each grid pointing - the closest one has the largest value
+    dots = GRID_XYZ.dot(target)
+    if maxsigma is not None:
+        dots = numpy.where(GRID_SIGMA <= maxsigma, dots, -2.0)  # Rule out grid points with too high a sigma
+    i = int(numpy.argmax(dots))
+    if dots[i] < -1.5:
         if (maxsigma is None):
             print('No grid pointings matched')
         else:
             print('No grid pointings matched grid with maxsigma=%.1e' % maxsigma)
         return None, None, None
-    number, azimuth, elevation, sigma, delays = closest
+    number, azimuth, elevation, sigma, delays = GRID_POINTS[i]
     return azimuth, elevation, delays
 
 
+def best_offset(delays, delaystep, maxdelay):
+    """Given the 16 geometric dipole delays for a tile (all positive, in picoseconds), return the offset to add to
+       all of them, from -0.45 to +0.45 delay steps in 1/20th step increments, that gives the smallest mean
+       squared deviation between the offset delays and the nearest delay settings (clipped to maxdelay).
+
+       All 19 candidate offsets are tried at once, as a (19, 16) array of offset delays. Offsets half a delay step
+       apart often give the same mean squared deviation, apart from floating point rounding, so any offsets within
+       OFFSET_TIE_TOLERANCE of the best are treated as equally good, and the one closest to zero is returned (the
+       negative one, if there are two).
+
+       :param delays: A numpy array (or list) of 16 delays, in picoseconds
+       :param delaystep: Delay line increment, in picoseconds
+       :param maxdelay: Maximum delay setting, in units of delaystep
+       :return: The best offset, in picoseconds
+    """
+    offsets = numpy.arange(-9, 10) * (delaystep / 20.0)
+    delays_off = numpy.asarray(delays, dtype=numpy.float64)[numpy.newaxis, :] + offsets[:, numpy.newaxis]
+    intdels = numpy.minimum(numpy.rint(delays_off / delaystep), maxdelay)
+    sqdev = ((intdels * delaystep - delays_off) ** 2).mean(axis=1)
+    tied = numpy.flatnonzero(sqdev <= sqdev.min() + OFFSET_TIE_TOLERANCE)
+    return float(offsets[tied[numpy.argmin(numpy.abs(offsets[tied]))]])
+
+
 def gettiledelays(cpos=None, az=0.0, el=90.0):
     """
        Copied from function calc_delays in obssched/pycontroller.py, with
@@ -332,25 +449,19 @@ def gettiledelays(cpos=None, az=0.0, el=90.0):
     """
     if cpos is None:
         cpos = v(0, 0, 0)
-    elif type(cpos) == tuple:
-        cpos = v(cpos)
+    elif isinstance(cpos, tuple):
+        cpos = v(*cpos)
 
     # Find the delay values for the nearest sweetspot, to use for green arrows:
     sweetaz, sweetel, sweetdelays = get_sweet_delays(az=az, el=el)
 
     # Calculate the geometric delays for the ax/el given, without using sweetspot
-    dip_sep = 1.10  # dipole separations in meters
     delaystep = 435.0  # Delay line increment in picoseconds
     maxdelay = 31  # Maximum number of deltastep delays
     c = 0.000299798  # C in meters/picosecond
-    dtor = math.pi / 180.0  # convert degrees to radians
     # define zenith angle
     za = 90 - el
 
-    # Define arrays to hold the positional offsets of the dipoles
-    xoffsets = [0.0] * 16  # offsets of the dipoles in the W-E 'x' direction
-    yoffsets = [0.0] * 16  # offsets of the dipoles in the S-N 'y' direction
-    delays = [0.0] * 16  # The calculated delays in picoseconds
     rdelays = [0] * 16  # The rounded delays in units of delaystep
 
     delaysettings = [0] * 16  # return values
@@ -359,61 +470,19 @@ def gettiledelays(cpos=None, az=0.0, el=90.0):
     if (abs(za) > 90):
         return None
 
-        # Offsets of the dipoles are calculated relative to the
-        # center of the tile, with positive values being in the north
-        # and east directions
-
-    xoffsets[0] = -1.5 * dip_sep
-    xoffsets[1] = -0.5 * dip_sep
-    xoffsets[2] = 0.5 * dip_sep
-    xoffsets[3] = 1.5 * dip_sep
-    xoffsets[4] = -1.5 * dip_sep
-    xoffsets[5] = -0.5 * dip_sep
-    xoffsets[6] = 0.5 * dip_sep
-    xoffsets[7] = 1.5 * dip_sep
-    xoffsets[8] = -1.5 * dip_sep
-    xoffsets[9] = -0.5 * dip_sep
-    xoffsets[10] = 0.5 * dip_sep
-    xoffsets[11] = 1.5 * dip_sep
-    xoffsets[12] = -1.5 * dip_sep
-    xoffsets[13] = -0.5 * dip_sep
-    xoffsets[14] = 0.5 * dip_sep
-    xoffsets[15] = 1.5 * dip_sep
-
-    yoffsets[0] = 1.5 * dip_sep
-    yoffsets[1] = 1.5 * dip_sep
-    yoffsets[2] = 1.5 * dip_sep
-    yoffsets[3] = 1.5 * dip_sep
-    yoffsets[4] = 0.5 * dip_sep
-    yoffsets[5] = 0.5 * dip_sep
-    yoffsets[6] = 0.5 * dip_sep
-    yoffsets[7] = 0.5 * dip_sep
-    yoffsets[8] = -0.5 * dip_sep
-    yoffsets[9] = -0.5 * dip_sep
-    yoffsets[10] = -0.5 * dip_sep
-    yoffsets[11] = -0.5 * dip_sep
-    yoffsets[12] = -1.5 * dip_sep
-    yoffsets[13] = -1.5 * dip_sep
-    yoffsets[14] = -1.5 * dip_sep
-    yoffsets[15] = -1.5 * dip_sep
-
     # First, figure out the theoretical delays to the dipoles
-    # relative to the center of the tile
+    # relative to the center of the tile, using the dipole offsets in TILE_XY (positive values
+    # being in the north and east directions)
 
     # Convert to radians
-    azr = az * dtor
-    zar = za * dtor
+    azr = az * DTOR
+    zar = za * DTOR
 
-    for i in range(16):
-        # calculate exact delays in picoseconds from geometry...
-        delays[i] = (xoffsets[i] * math.sin(azr) + yoffsets[i] * math.cos(azr)) * math.sin(zar) / c
-
-    # Find minimum delay
-    mindelay = min(delays)
+    # calculate exact delays in picoseconds from geometry...
+    delays = (TILE_XY[:, 0] * math.sin(azr) + TILE_XY[:, 1] * math.cos(azr)) * (math.sin(zar) / c)
 
     # Subtract minimum delay so that all delays are positive
-    for i in range(16):
-        delays[i] -= mindelay
+    delays -= delays.min()
 
     # Now minimize the sum of the deviations^2 from optimal
     # due to errors introduced when rounding the delays.
@@ -421,38 +490,7 @@ def gettiledelays(cpos=None, az=0.0, el=90.0):
     # see how the sum of square deviations changes
     # and then selecting the delays corresponding to the min sq dev.
 
-    # Go through once to get baseline values to compare
-    bestoffset = -0.45 * delaystep
-    minsqdev = 0
-
-    for i in range(16):
-        delay_off = delays[i] + bestoffset
-        intdel = int(round(delay_off / delaystep))
-
-        if (intdel > maxdelay):
-            intdel = maxdelay
-
-        minsqdev += math.pow((intdel * delaystep - delay_off), 2)
-
-    minsqdev = minsqdev / 16
-
-    offset = (-0.45 * delaystep) + (delaystep / 20.0)
-    while offset <= (0.45 * delaystep):
-        sqdev = 0
-        for i in range(16):
-            delay_off = delays[i] + offset
-            intdel = int(round(delay_off / delaystep))
-
-            if (intdel > maxdelay):
-                intdel = maxdelay
-            sqdev = sqdev + math.pow((intdel * delaystep - delay_off), 2)
-
-        sqdev = sqdev / 16
-        if (sqdev < minsqdev):
-            minsqdev = sqdev
-            bestoffset = offset
-
-        offset += delaystep / 20.0
+    bestoffset = best_offset(delays, delaystep, maxdelay)
 
     for i in range(16):
         rdelays[i] = int(round((delays[i] + bestoffset) / delaystep))
@@ -473,27 +511,25 @@ def gettiledelays(cpos=None, az=0.0, el=90.0):
         parrowsw = 0.2
 
     north = v(0, 1, 0)  # Due north, elevation 0 degrees
-    at1 = vpython.rotate(north, angle=(el * math.pi / 180),
+    at1 = vpython.rotate(north, angle=(el * DTOR),
                          axis=v(1, 0, 0))  # Rotate up (around E/W axis) by 'el' degrees
-    apvector = vpython.rotate(at1, angle=(-az * math.pi / 180),
+    apvector = vpython.rotate(at1, angle=(-az * DTOR),
                               axis=v(0, 0, 1))  # Rotate clockwise by 'az' degrees around 'up' axis
-    aarrow = vpython.arrow(pos=v(0, 0, 0), axis=apvector, color=color.white, length=parrowlen, shaftwidth=parrowsw,
-                           visible=avis)
+    aarrow = place_arrows('tilepointing', [(v(0, 0, 0), parrowlen)], apvector, avis, color=color.white, shaftwidth=parrowsw)[0]
 
     if (sweetaz is not None) and (sweetel is not None):
-        st1 = vpython.rotate(north, angle=(sweetel * math.pi / 180),
+        st1 = vpython.rotate(north, angle=(sweetel * DTOR),
                              axis=v(1, 0, 0))  # Rotate up (around E/W axis) by 'el' degrees
-        spvector = vpython.rotate(st1, angle=(-sweetaz * math.pi / 180),
+        spvector = vpython.rotate(st1, angle=(-sweetaz * DTOR),
                                   axis=v(0, 0, 1))  # Rotate clockwise by 'az' degrees around 'up' axis
-        sarrow = vpython.arrow(pos=v(0, 0, 0), axis=spvector, color=color.green, length=parrowlen, shaftwidth=parrowsw,
-                               visible=avis)
-        alist = [sarrow]
+        alist = place_arrows('sweetpointing', [(v(0, 0, 0), parrowlen)], spvector, avis, color=color.green,
+                             shaftwidth=parrowsw)
     else:
-        alist = []
+        alist = place_arrows('sweetpointing', [], None, avis)
         spvector = None
 
-    ilist = [aarrow]
-    dlist = []
+    ideal = []
+    sweet = []
     for i in range(16):
         # Arrow lengths are negative if delays are positive, and vice/versa
         idealdelay = delaysettings[i] * TILEDELAYSTEP * pointing.C
@@ -501,9 +537,11 @@ def gettiledelays(cpos=None, az=0.0, el=90.0):
         dpos = v(dposx, dposy, 0) + cpos
         if sweetdelays:
             sweetdelay = sweetdelays[i] * TILEDELAYSTEP * pointing.C
-            alist.append(vpython.arrow(pos=dpos, axis=spvector, length=-sweetdelay, color=color.green, shaftwidth=0.2,
-                                       visible=avis))
-        ilist.append(vpython.arrow(pos=dpos, axis=apvector, length=-idealdelay, color=color.white, shaftwidth=0.2, visible=avis))
+            sweet.append((dpos, -sweetdelay))
+        ideal.append((dpos, -idealdelay))
+    ilist = [aarrow] + place_arrows('ideal', ideal, apvector, avis, color=color.white, shaftwidth=0.2)
+    alist += place_arrows('sweet', sweet, spvector, avis, color=color.green, shaftwidth=0.2)
+    dlist = []
 
     # Tiles have two pointing arrows, stored in the 'alist' and 'ilist', so return None for the first element.
     return None, ilist, alist, dlist
@@ -518,16 +556,25 @@ def processClick(event):
         print(s)
         if (s == 'a') or (s == 's'):  # Toggle the visibility of the 'actual' delays
             avis = not avis
-            for ob in alist:
-                ob.visible = avis
+            if avis:  # The arrows may not have been built while they were hidden
+                redraw_arrows()
+            else:
+                for ob in alist:
+                    ob.visible = False
         elif s == 'i':  # Toggle the visibility of the 'ideal' delays
             ivis = not ivis
-            for ob in ilist:
-                ob.visible = ivis
+            if ivis:  # The arrows may not have been built while they were hidden
+                redraw_arrows()
+            else:
+                for ob in ilist:
+                    ob.visible = False
         elif s == 'd':
             dvis = not dvis
-            for ob in dlist:
-                ob.visible = dvis
+            if dvis:  # The arrows may not have been built while they were hidden
+                redraw_arrows()
+            else:
+                for ob in dlist:
+                    ob.visible = False
         elif s == 'up':
             el += 5
             if el > 90:
@@ -548,7 +595,9 @@ def processClick(event):
             if az >= 360:
                 az -= 360
             redraw_arrows()
-        elif s == 'r':
+        elif s == 'r':  # Recalculate everything from scratch
+            cached_eda_delays.cache_clear()
+            get_sweet_delays.cache_clear()
             redraw_arrows()
 
     except AttributeError:  # Mouse clicked:
@@ -558,32 +607,16 @@ def processClick(event):
 def redraw_arrows():
     global parrow, ilist, alist, dlist, az, el
 
-    if mode == 'EDA':
-        parrow.visible = False
-    for ob in ilist:
-        ob.visible = False
-    for ob in alist:
-        ob.visible = False
-    for ob in dlist:
-        ob.visible = False
-
-    del ilist
-    del alist
-    del dlist
-    del parrow
-
+    # The same arrow objects are re-used for the new pointing, so there's no need to hide or delete the old ones
     if mode == 'EDA':
         result = getedadelays(az=az, el=el)
-        if result is not None:
-            parrow, ilist, alist, dlist = result
-        else:
-            parrow, ilist, alist, dlist = None, [], [], []
     else:
         result = gettiledelays(az=az, el=el)
-        if result is not None:
-            parrow, ilist, alist, dlist = result
-        else:
-            parrow, ilist, alist, dlist = None, [], [], []
+    if result:
+        parrow, ilist, alist, dlist = result
+    else:
+        hide_arrows()
+        parrow, ilist, alist, dlist = None, [], [], []
 
     for ob in ilist:
         ob.visible = ivis
@@ -667,12 +700,16 @@ if __name__ == '__main__':
 
     avis, ivis, dvis = True, False, False
 
+    # Keep the canvas hidden while the model is built, so the browser doesn't redraw it after every batch of the
+    # thousands of new objects arrives, then show it all at once.
+    scene.visible = False
     if mode == 'EDA':
         eda = geteda()
         parrow, ilist, alist, dlist = getedadelays(az=az, el=el)
     else:
         tile = gettile()
         parrow, ilist, alist, dlist = gettiledelays(az=az, el=el)
+    scene.visible = True
 
     scene.bind('click keydown', processClick)
     print("Pointing direction is shown by yellow arrow. ")